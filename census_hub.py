@@ -0,0 +1,236 @@
+# One census push connection shared by a few kills counters on the same machine.
+# Every OBS with scripted_text_mod1.py connects here instead of census, the hub keeps
+# one census subscription for characters of all of them and sends every counter
+# only the events of its own characters.
+#
+# to run: python census_hub.py --port 8766
+# then put HUB_URL = 'ws://127.0.0.1:8766/streaming' into scripted_text_mod1.py of every OBS
+#
+# Counters speak to the hub exactly like to census: subscribe and clearSubscribe messages.
+# A character is added to the census subscription when the first counter asks for it and
+# removed when the last one doesn't need it anymore, nothing is resubscribed as a whole.
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import websockets
+from aiohttp import web, WSMsgType
+
+import scripted_text_mod1 as tracker
+
+
+class Client:
+    """A connected counter and what it is subscribed for"""
+
+    __slots__ = ('ws', 'characters', 'events')
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.characters = set() # character IDs
+        self.events = set() # event names
+
+
+class Hub:
+    """Keeps the census connection and the local clients. Everything runs on one loop"""
+
+    def __init__(self, upstream_url: str):
+        self.upstream_url = upstream_url
+        self.upstream = None # census connection, None while it's down
+        self.clients = set()
+        self.watchers = {} # character ID -> set of clients subscribed for it
+        self.events = set() # event names census was asked for
+        self.stats = {'received': 0, 'forwarded': 0, 'dropped': 0}
+
+    # WHAT CLIENTS ASK FOR
+
+    async def subscribe(self, client: Client, characters: list, events: list) -> None:
+        """Adds characters and events to the client. Census is asked only about
+        characters nobody had and events which weren't asked for yet"""
+
+        new_characters = []
+        for char_id in characters:
+            if char_id in client.characters:
+                continue
+            client.characters.add(char_id)
+            watchers = self.watchers.setdefault(char_id, set())
+            if not watchers:
+                new_characters.append(char_id)
+            watchers.add(client)
+        client.events.update(events)
+        new_events = [ event for event in events if event not in self.events ]
+        self.events.update(new_events)
+        if new_characters or new_events:
+            await self.send_upstream({
+                'service': 'event',
+                'action': 'subscribe',
+                'characters': new_characters,
+                'eventNames': new_events,
+            })
+
+    async def unsubscribe(self, client: Client, characters: list) -> None:
+        """Removes characters from the client. Census forgets only characters nobody needs.
+        Event names stay, events of characters nobody watches don't come anyway"""
+
+        gone = []
+        for char_id in characters:
+            if char_id not in client.characters:
+                continue
+            client.characters.discard(char_id)
+            watchers = self.watchers.get(char_id, set())
+            watchers.discard(client)
+            if not watchers:
+                self.watchers.pop(char_id, None)
+                gone.append(char_id)
+        if gone:
+            await self.send_upstream({'service': 'event', 'action': 'clearSubscribe', 'characters': gone})
+
+    async def send_upstream(self, request: dict) -> None:
+        # while census is down nothing is sent, the whole subscription goes after the reconnect
+        if self.upstream is None:
+            return
+        try:
+            await self.upstream.send(json.dumps(request))
+        except Exception as e:
+            print('<send_upstream> census didnt get the request:', e)
+
+    def acknowledgement(self, client: Client) -> str:
+        """The same answer census gives on subscribe and clearSubscribe"""
+
+        return json.dumps({'subscription': {
+            'characterCount': len(client.characters),
+            'eventNames': sorted(client.events),
+            'logicalAndCharactersWithWorlds': False,
+            'worlds': [],
+        }})
+
+    async def serve_client(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client = Client(ws)
+        self.clients.add(client)
+        print(f'<serve_client> a counter connected, {len(self.clients)} now')
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    data = json.loads(message.data)
+                except ValueError:
+                    continue
+                action = data.get('action')
+                if action == 'subscribe':
+                    await self.subscribe(client, data.get('characters', []), data.get('eventNames', []))
+                elif action == 'clearSubscribe':
+                    if str(data.get('all')).lower() == 'true':
+                        await self.unsubscribe(client, list(client.characters))
+                    else:
+                        await self.unsubscribe(client, data.get('characters', []))
+                else:
+                    continue
+                await ws.send_str(self.acknowledgement(client))
+        finally:
+            self.clients.discard(client)
+            await self.unsubscribe(client, list(client.characters))
+            print(f'<serve_client> a counter disconnected, {len(self.clients)} left')
+        return ws
+
+    # WHAT CENSUS SENDS
+
+    async def route(self, message: str) -> None:
+        """Sends the raw message to clients which need it, without decoding it"""
+
+        self.stats['received'] += 1
+        # heartbeats tell every counter the connection is alive
+        if '"heartbeat"' in message:
+            targets = self.clients
+        else:
+            event = tracker._EVENT_NAME.search(message)
+            if event is None:
+                # subscription acknowledgements and service states are for the hub only
+                self.stats['dropped'] += 1
+                return
+            targets = set()
+            for pattern in (tracker._ATTACKER_ID, tracker._CHARACTER_ID):
+                found = pattern.search(message)
+                if found:
+                    targets |= self.watchers.get(found.group(1), set())
+            targets = [ client for client in targets if event.group(1) in client.events ]
+        if not targets:
+            self.stats['dropped'] += 1
+            return
+        self.stats['forwarded'] += len(targets)
+        # a slow client doesn't hold the others
+        await asyncio.gather(*[ client.ws.send_str(message) for client in targets ], return_exceptions=True)
+
+    async def run_upstream(self) -> None:
+        """Keeps the census connection. Waits between reconnects grow like in the counter.
+        When census drops, clients are dropped too, so they fill the gap themselves"""
+
+        attempt = 0
+        while True:
+            connected_at = None
+            try:
+                async with websockets.connect(self.upstream_url, close_timeout=5) as upstream:
+                    connected_at = time.monotonic()
+                    self.upstream = upstream
+                    print('<run_upstream> connected to census')
+                    if self.watchers:
+                        await self.send_upstream({
+                            'service': 'event',
+                            'action': 'subscribe',
+                            'characters': list(self.watchers),
+                            'eventNames': sorted(self.events),
+                        })
+                    while True:
+                        message = await asyncio.wait_for(upstream.recv(), tracker.STREAM_SILENCE_LIMIT)
+                        await self.route(message)
+            except asyncio.TimeoutError:
+                print(f'<run_upstream> no messages for {tracker.STREAM_SILENCE_LIMIT} seconds, reconnecting')
+            except Exception as e:
+                print('<run_upstream> census connection error:', e)
+            self.upstream = None
+            for client in list(self.clients):
+                await client.ws.close()
+            if connected_at is not None and time.monotonic() - connected_at >= tracker.HEALTHY_SESSION:
+                attempt = 0
+            sleep_time = random.uniform(
+                0, min(tracker.RECONNECT_MAX_DELAY, tracker.RECONNECT_BASE_DELAY * 2 ** min(attempt, 16))
+            )
+            print(f'<run_upstream> waiting for {sleep_time:.1f} seconds')
+            await asyncio.sleep(sleep_time)
+            attempt += 1
+
+
+async def serve(hub: Hub, host: str, port: int) -> None:
+    app = web.Application()
+    app.router.add_get('/streaming', hub.serve_client)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f'<serve> counters can connect to ws://{host}:{port}/streaming')
+    try:
+        await hub.run_upstream()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='One census push connection for a few kills counters')
+    parser.add_argument('--host', default='127.0.0.1', help='local address for counters')
+    parser.add_argument('--port', type=int, default=8766, help='local port for counters')
+    parser.add_argument('--upstream', default=tracker.CENSUS_PUSH_URL, help='census push service URL')
+    args = parser.parse_args()
+
+    hub = Hub(args.upstream)
+    try:
+        asyncio.run(serve(hub, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    print(f'<main> census messages: {hub.stats["received"]}, sent to counters: {hub.stats["forwarded"]}, '
+          f'dropped: {hub.stats["dropped"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+# Replays recorded census traffic or a made-up event stream through the kills counter
+# without OBS and without the real census, and measures how fast it goes.
+#
+# to record: set RECORD_FILE in scripted_text_mod1.py and use the script in OBS as usual
+# to replay: python census_replay.py --log census.log --speed 10
+# made-up stream: python census_replay.py --synthetic 100000 --speed 0 --memory
+#
+# --speed 1 keeps the original pauses between messages, 0 sends them as fast as possible.
+# The local stand-in serves the push service on /streaming and REST answers on any other path.
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import zlib
+from urllib.parse import parse_qsl, urlsplit
+from aiohttp import web
+
+
+def install_obs_stub() -> types.ModuleType:
+    """Puts a stand-in of obspython into sys.modules. Every OBS function
+    does nothing, obs_source_update only counts the calls"""
+
+    stub = types.ModuleType('obspython')
+    stub.updates = 0
+
+    def obs_source_update(source, settings):
+        stub.updates += 1
+
+    stub.obs_source_update = obs_source_update
+    stub.OBS_INVALID_HOTKEY_ID = -1
+    # anything else which the tracker asks for is a function doing nothing
+    stub.__getattr__ = lambda name: (lambda *args, **kwargs: None)
+    sys.modules['obspython'] = stub
+    return stub
+
+
+OBS = install_obs_stub()
+import scripted_text_mod1 as tracker # must be imported after the stub
+
+
+# WHAT TO REPLAY
+
+def rest_key(path: str, query: str) -> tuple:
+    """Census paths contain the service ID, so only the last part of the path
+    and the query tell requests apart. For voidwell the last part is the item ID"""
+
+    return path.rsplit('/', 1)[-1], tuple(sorted(parse_qsl(query)))
+
+
+def load_log(path: str) -> tuple:
+    """Reads a file written with RECORD_FILE. Returns a list of (time, push message)
+    and a function answering REST requests with the recorded answers"""
+
+    frames = []
+    answers = {}
+    with open(path, encoding='utf-8') as log:
+        for line in log:
+            entry = json.loads(line)
+            if 'ws' in entry:
+                frames.append((entry['t'], entry['ws']))
+            elif 'rest' in entry:
+                parts = urlsplit(entry['key'])
+                # the first answer is the one the tracker got on start
+                answers.setdefault(rest_key(parts.path, parts.query), entry['rest'])
+    return frames, lambda path, query: answers.get(rest_key(path, query))
+
+
+class Synthetic:
+    """Made-up characters and guns from NAME_LIST and GUN_LIST of the tracker, all of them
+    online, and a stream of kills where only a share of kills is done by tracked ones"""
+
+    def __init__(self, events: int, rate: float, tracked_share: float):
+        self.char_ids = { name: str(5428000000000000000 + num) for num, name in enumerate(tracker.NAME_LIST) }
+        self.gun_ids = { gun_name: str(800000 + num) for num, gun_name in enumerate(tracker.GUN_LIST) }
+        self.events = events
+        self.rate = rate
+        self.tracked_share = tracked_share
+
+    def answer(self, path: str, query: str) -> str | None:
+        collection = path.rsplit('/', 1)[-1]
+        params = dict(parse_qsl(query))
+        if collection == 'character_name':
+            return json.dumps({'character_name_list': [
+                {'character_id': char_id, 'name': {'first': name}, 'online': {'online_status': '1'}}
+                for name, char_id in self.char_ids.items()
+            ]})
+        if collection == 'item':
+            names = params.get('name.en', '').split(',')
+            return json.dumps({'item_list': [
+                {'item_id': self.gun_ids[name], 'name': {'en': name}} for name in names if name in self.gun_ids
+            ]})
+        if collection == 'characters_weapon_stat_by_faction':
+            return json.dumps({'characters_weapon_stat_by_faction_list': [
+                {
+                    'character_id': params.get('character_id'), 'item_id': gun_id, 'character': {'faction_id': '1'},
+                    'value_vs': '10', 'value_nc': str(random.randint(100, 5000)), 'value_tr': str(random.randint(100, 5000)),
+                }
+                for gun_id in self.gun_ids.values()
+            ]})
+        if collection == 'characters_event':
+            return json.dumps({'characters_event_list': []})
+        if collection in self.gun_ids.values():
+            # 100 players in pages of 30, the last page is shorter
+            first = int(params.get('page', 0)) * 30
+            return json.dumps([
+                {'name': f'player{num}', 'kills': 20000 - num * 150} for num in range(first, min(first + 30, 100))
+            ])
+        return None
+
+    def frames(self) -> list:
+        """Pushed messages like the real service sends them, serialized beforehand
+        so the stand-in spends no time on them during the replay"""
+
+        pairs = [ (char_id, gun_id) for char_id in self.char_ids.values() for gun_id in self.gun_ids.values() ]
+        started = time.time()
+        frames = [(started, json.dumps({'subscription': {
+            'characterCount': len(self.char_ids),
+            'eventNames': ['Death', 'PlayerLogin', 'PlayerLogout', 'VehicleDestroy'],
+            'logicalAndCharactersWithWorlds': False,
+            'worlds': [],
+        }}))]
+        for num in range(self.events):
+            t = started + num / self.rate
+            if num % 50 == 0:
+                frames.append((t, json.dumps({
+                    'online': {'EventServerEndpoint_Cobalt_13': 'true'}, 'service': 'event', 'type': 'heartbeat',
+                })))
+                continue
+            if random.random() < self.tracked_share:
+                attacker, weapon = random.choice(pairs)
+            else:
+                attacker, weapon = str(5428000000000100000 + random.randint(0, 10000)), str(random.randint(1, 900000))
+            frames.append((t, json.dumps({'payload': {
+                'attacker_character_id': attacker,
+                'attacker_fire_mode_id': '7000',
+                'attacker_loadout_id': '17',
+                'attacker_team_id': '2',
+                'attacker_vehicle_id': '0',
+                'attacker_weapon_id': weapon,
+                'character_id': str(5428000000001000000 + num),
+                'character_loadout_id': '8',
+                'event_name': 'Death',
+                'is_headshot': '0',
+                'team_id': '3',
+                'timestamp': str(int(t)),
+                'world_id': '17',
+                'zone_id': '2',
+            }, 'service': 'event', 'type': 'serviceMessage'})))
+        return frames
+
+
+# THE LOCAL STAND-IN
+
+class StandIn:
+    """Local census push service and REST API. Runs on its own thread with its own loop,
+    so sending messages doesn't take time from the measured tracker loop"""
+
+    def __init__(self, frames: list, answer, speed: float):
+        self.frames = frames
+        self.answer = answer
+        self.speed = speed
+        self.stream_started = None # time.perf_counter() of the first sent message
+        self.loop = asyncio.new_event_loop()
+        self.runner = None
+        self.port = None
+
+    async def push(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        # the first message is the subscription of the tracker
+        await ws.receive()
+        started = time.perf_counter()
+        # every tracker gets the whole stream, the first one starts the measurement
+        if self.stream_started is None:
+            self.stream_started = started
+        first = self.frames[0][0] if self.frames else 0
+        for t, message in self.frames:
+            if self.speed:
+                delay = started + (t - first) / self.speed - time.perf_counter()
+                # sleeping for less than a millisecond makes no sense, the loop is not that precise
+                if delay > 0.001:
+                    await asyncio.sleep(delay)
+            await ws.send_str(message)
+        await ws.close()
+        return ws
+
+    async def rest(self, request):
+        body = self.answer(request.path, request.query_string)
+        if body is None:
+            return web.Response(status=404, text='{}', content_type='application/json')
+        # answers never change here, so conditional requests always get 304
+        etag = f'"{zlib.crc32(body.encode()):08x}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=body, content_type='application/json', headers={'ETag': etag})
+
+    def start(self) -> int:
+        """Starts the stand-in on a free local port, returns the port"""
+
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        app = web.Application()
+        app.router.add_get('/streaming', self.push)
+        app.router.add_get('/{tail:.*}', self.rest)
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        self.loop.run_until_complete(web.SockSite(self.runner, sock).start())
+        threading.Thread(None, self.loop.run_forever, daemon=True).start()
+        return self.port
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# THE MEASUREMENT
+
+def make_trackers(count: int) -> list:
+    """The tracker of the script and count - 1 more independent ones, each with its own text source"""
+
+    trackers = [tracker.TRACKER]
+    for num in range(1, count):
+        widget = tracker.make_widget((f'replay{num}',), tracker.TEXT_TEMPLATE, tracker.TEXT_TEMPLATE)
+        trackers.append(tracker.Tracker(name=f'replay{num}', widgets=(widget,)))
+    return trackers
+
+
+async def run_tracker(port: int, trackers: list) -> float:
+    """Runs one census connection of every tracker against the stand-in, all on one loop.
+    Returns time.perf_counter() when the stream was over for all of them"""
+
+    base = f'http://127.0.0.1:{port}'
+    tracker.URL = base + '/census/'
+    tracker.VOIDWELL_URL = base + '/voidwell/'
+    tracker.PUSH_URL = f'ws://127.0.0.1:{port}/streaming'
+    tracker.SOURCE = 'replay'
+    tracker.SINKS[:] = [tracker.ObsSink()]
+    renderer = asyncio.create_task(tracker.render_loop())
+    await asyncio.gather(*[ one.connect_census() for one in trackers ])
+    finished = time.perf_counter()
+    # refreshes and backfills which are still on their way
+    await asyncio.gather(*[ one.stop() for one in trackers ])
+    renderer.cancel()
+    tracker.render_tick()
+    await tracker.close_sessions()
+    return finished
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays census traffic through the kills counter and measures it')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--log', help='a file written with RECORD_FILE')
+    source.add_argument('--synthetic', type=int, metavar='EVENTS', help='amount of made-up push messages')
+    parser.add_argument('--rate', type=float, default=50, help='made-up messages per second of game time')
+    parser.add_argument('--tracked-share', type=float, default=0.05, help='share of made-up kills done by tracked characters and guns')
+    parser.add_argument('--speed', type=float, default=1, help='replay speed, 0 is as fast as possible')
+    parser.add_argument('--memory', action='store_true', help='trace memory allocations, makes everything slower')
+    parser.add_argument('--record', metavar='FILE', help='record what the tracker gets, like RECORD_FILE does')
+    parser.add_argument('--trackers', type=int, default=1, help='independent trackers in one process, each gets the whole stream')
+    args = parser.parse_args()
+
+    if args.log:
+        frames, answer = load_log(args.log)
+    else:
+        synthetic = Synthetic(args.synthetic, args.rate, args.tracked_share)
+        frames, answer = synthetic.frames(), synthetic.answer
+    stand_in = StandIn(frames, answer, args.speed)
+    port = stand_in.start()
+    if args.record:
+        tracker.RECORD_FILE = args.record
+        tracker.recorder_open()
+    if args.memory:
+        tracemalloc.start()
+    trackers = make_trackers(max(1, args.trackers))
+    finished = asyncio.run(run_tracker(port, trackers))
+    stand_in.stop()
+    tracker.recorder_close()
+
+    elapsed = finished - (stand_in.stream_started or finished)
+    messages = len(frames) * len(trackers)
+    print(f'messages: {messages} in {elapsed:.3f} s, {messages / elapsed if elapsed else 0:.0f} per second')
+    print(f'processed/dropped: {tracker.message_stats()}')
+    for one in trackers:
+        print(f'{one.name}: {sum(one.session_kills)} kills counted, shown {one.state.char_name} {one.state.kills}')
+    print(f'text source updates: {OBS.updates}')
+    print(f'leaderboards: {tracker.LEADERBOARD_STATS}')
+    print(tracker.rest_summary())
+    if args.memory:
+        current, peak = tracemalloc.get_traced_memory()
+        print(f'memory: {current / 1024:.0f} KiB now, {peak / 1024:.0f} KiB at peak')
+    print(f'latency:\n{tracker.latency_summary()}')
+
+
+if __name__ == '__main__':
+    main()
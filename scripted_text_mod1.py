@@ -3,23 +3,91 @@
 # get a service ID here https://census.daybreakgames.com/ and insert it into "SERVICE_ID"
 # put desired characters into the NAME_LIST array in any case like in the example
 # put the desired gun names into GUN_LIST exactly like they are called in the game
-# only one gun can be tracked for each character
+# kills with every gun are counted, the screen shows the first gun from GUN_LIST the character has kills with
 # add a text source in the OBS, pick it
 # add start/stop hotkeys if needed - Htk start/stop kills counter
-
-import obspython as obs
+# without OBS: python scripted_text_mod1.py --source kills --file kills.txt --http 8765 --stdout
+# the text goes to a file, to a local page for browser sources (http://127.0.0.1:8765/kills) or to the console
+
+try:
+    import obspython as obs
+except ImportError:
+    # not inside OBS, only run_headless works then
+    obs = None
 import websockets
 import asyncio
+import heapq
+import itertools
 import json
+import math
+import os
+import random
+import re
+import sqlite3
+import string
+import sys
 import threading
+import time
+import aiohttp
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from collections import deque
 from contextlib import contextmanager
-from requests import get
+from urllib.parse import urlencode, urlsplit
 
 # ============== put your data here =====================
 
 NAME_LIST: list = ['aliantares', 'leopoldlocust', 'konradkestrel'] # all tracked character names
 GUN_LIST: list = ['M20 Kestrel', 'Antares LC', 'M18 Locust'] # all tracked guns
 SERVICE_ID = '<your_id>'
+REST_TIMEOUT: float = 10 # seconds, the longest one census or voidwell request may take
+BACKFILL_PAGE: int = 1000 # kills per one census request when missed kills are requested after a reconnect
+STREAM_SILENCE_LIMIT: float = 75 # seconds without any message, heartbeats included, before the connection is dropped
+RECONNECT_BASE_DELAY: float = 2 # seconds, the longest wait before the first reconnect attempt
+RECONNECT_MAX_DELAY: float = 120 # seconds, the waits between reconnect attempts don't grow over this
+HEALTHY_SESSION: float = 60 # seconds, a connection which lived this long resets the waits
+RECORD_FILE: str | None = None # if set, raw push messages and REST answers are appended there for census_replay.py
+MAX_LEADERBOARD_PAGES: int = 20 # voidwell leaderboard pages loaded at most while looking for the character
+LEADERBOARD_LINES: int = 10 # players above the character shown with the leaderboard hotkey
+LEADERBOARD_TTL: float = 600 # seconds, leaderboards in memory are used without asking voidwell
+LEADERBOARD_REFRESH: float = 300 # seconds between background renewals of all leaderboards
+LEADERBOARD_PREFETCH_PAUSE: float = 1 # seconds between background leaderboard requests, they are not urgent
+# the text of the counter source, the default of its template in settings. Placeholders: {gun}, {kills},
+# {goal} ("/kills of the top player" or nothing), {rank}, {kpm1}, {kpm5}, {kpm15} (kills per minute over
+# the last 1/5/15 minutes), {streak} (kills since the last death), {session} (kills with the shown gun
+# since start), {session_guns} (all guns), {char}, {next_name}, {next_gap} (kills to pass the player
+# above), {top_gap} (kills to the top), {leaderboard} (the players above, one per line), {top_weapons}
+# and {vehicle_kills} (this session, need TRACK_ALL_WEAPONS)
+TEXT_TEMPLATE: str = '{gun} kills: {kills}{goal}'
+GOAL_TEMPLATE: str = 'Rank {rank}, {next_gap} kills to {next_name}' # the default for the goal source
+LEADERBOARD_TEMPLATE: str = '{leaderboard}' # the default for the leaderboard source
+METRICS_REFRESH: float = 10 # seconds, how often kills per minute on the screen are renewed without kills
+# kills with every weapon and vehicle kills of tracked characters are counted too, for
+# the {top_weapons} and {vehicle_kills} placeholders. Makes more push messages decoded
+TRACK_ALL_WEAPONS: bool = False
+TOP_WEAPONS: int = 5 # weapons in {top_weapons}
+RECONCILE_MIN: float = 120 # seconds, the shortest wait between checks of live counters against census stats
+RECONCILE_MAX: float = 1800 # seconds, waits grow up to this while nobody plays or kills
+HTTP_SINK_PORT: int | None = None # if set, texts are served for browser sources on this local port in OBS too
+# a few OBS on one machine may share one census connection: run census_hub.py and put
+# its address here, 'ws://127.0.0.1:8766/streaming' by default
+HUB_URL: str | None = None
+# requests per second and the burst allowed for every API host, others get REST_RATE_DEFAULT
+REST_RATE_LIMITS: dict = {
+    'census.daybreakgames.com': (5, 10), # census limits requests per service ID
+    'api.voidwell.com': (2, 4),
+}
+REST_RATE_DEFAULT: tuple = (5, 10)
+CACHE_FILE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'killtracker_cache.sqlite3')
+# seconds, how long cached values of every kind are trusted
+CACHE_TTL: dict = {
+    'char_id': 30 * 24 * 3600, # character names and IDs, they practically never change
+    'gun_id': 30 * 24 * 3600, # gun names and item IDs
+    'kills': 24 * 3600, # the last known kills of a character with its guns
+    'shown': 24 * 3600, # the character which was on the screen last time
+    'item_name': 30 * 24 * 3600, # names of weapons which aren't in GUN_LIST
+}
 # =======================================================
 
 # auto release context managers
@@ -46,250 +114,1885 @@ def data_ar(source_settings=None):
 
 _LOOP: asyncio.AbstractEventLoop | None = None
 _THREAD: threading.Thread | None = None
-NAMES_AND_IDS: dict = {} # mapping of names and IDs. Census even streaming works only with IDs
-CHAR_ONLINE: str | None = None # a name from NAME_LIST which is currently online
-CURRENT_GUN: str | None = None # a gun from GUN_LIST which exists in CHAR_ONLINE's stats
-CURRENT_GUN_ID: str | None = None # the id of a current gun
-CENSUS_LOOP_RUNNING_OK: bool = False # allows or not to connect to census and receive messages
+# characters, counters, tasks and everything else of one kills counter live in Tracker instances.
+# What is here is shared by all trackers of the process: endpoints, sources, REST scheduling and caches
 URL: str = f'https://census.daybreakgames.com/s:{SERVICE_ID}/get/ps2:v2/' # census URL
-KILLS: int | None = None # kills counter
+CENSUS_PUSH_URL: str = f'wss://push.planetside2.com/streaming?environment=ps2&service-id=s:{SERVICE_ID}' # census push service URL
+PUSH_URL: str = HUB_URL or CENSUS_PUSH_URL # where events come from, census itself or census_hub.py
+VOIDWELL_URL: str = 'https://api.voidwell.com/ps2/leaderboard/weapon/' # leaderboards by item ID
 # OBS will crash if we try to put text into non existing text source
 # It can happen if the text source was saved once and then deleted at the next launch.
 # if not True, the algorithm won't be allowed to run
 SOURCE: str | None = None
-LEADERS = [] # contains an array of tuples (name, kills) up to CHAR_ONLINE or to 10 items
-GOAL_KILLS: int | None = None # the maximum of kills done by a current weapon sp far
-CLOSEST_KILLS: int | None = None # the amount of kills of a player one tier above
+EXTRA_SOURCES: tuple = () # more text sources showing the same text, picked in settings
+# text sources of the scene collection. Enumerated once, then kept by OBS signals
+# about created, destroyed and renamed sources, so checking a name costs nothing
+TEXT_SOURCE_IDS: tuple = ('text_gdiplus', 'text_ft2_source')
+_TEXT_SOURCES: set = set()
+_TEXT_SOURCES_READY: bool = False
+_SETTINGS = None # settings of the script given by OBS in script_load, renamed sources are written there
+# leaderboards of all tracked guns are kept in memory and renewed in background, so a login
+# or the hotkey don't wait for voidwell. An entry is replaced as a whole, never changed in place
+_LEADERBOARDS: dict = {} # item ID -> {'pages', 'validators', 'complete', 'lowest', 'stored'}
+# live counters drift from census stats when events are lost or filtered differently. They
+# are compared from time to time, a difference is added to the counter, nothing is reset
+RECONCILE_STATS: dict = {'rounds': 0, 'checked': 0, 'corrected': 0, 'added': 0, 'removed': 0, 'largest': 0}
+LEADERBOARD_STATS: dict = {'memory': 0, 'not_modified': 0, 'downloaded': 0} # leaderboard requests and pages since OBS launch
+FACTION_TAGS: dict = {'1': 'vs', '2': 'nc', '3': 'tr'} # census faction IDs, NSO (4) has no own faction kills
+ITEM_NAMES: dict = {} # item ID -> name of weapons seen in weapon tables
+_SESSIONS: dict = {} # one pooled keep-alive http session per host, lives on _LOOP
+# most of push messages are not needed. They are recognized in the raw string by these
+# patterns, only the needed ones are decoded with json.loads
+_EVENT_NAME = re.compile(r'"event_name"\s*:\s*"(\w+)"')
+_ATTACKER_ID = re.compile(r'"attacker_character_id"\s*:\s*"(\d+)"')
+_WEAPON_ID = re.compile(r'"attacker_weapon_id"\s*:\s*"(\d+)"')
+_CHARACTER_ID = re.compile(r'"character_id"\s*:\s*"(\d+)"')
+MESSAGE_STATS: dict = {} # message kind -> [processed, dropped] since OBS launch
+_CACHE: sqlite3.Connection | None = None # on-disk cache, used only from the census thread
+CACHE_STATS: dict = {'hit': 0, 'miss': 0} # cache lookups since OBS launch
+# text updates are not sent to OBS from the census thread. They wait here, only the latest
+# string per source, until render_tick takes them on the OBS main thread
+_RENDER_QUEUE: dict = {} # source name -> the latest text for it
+_RENDER_LOCK = threading.Lock() # guards _RENDER_QUEUE, both threads write there
+_RENDERED: dict = {} # source name -> the text which is on the screen now
+RENDER_FPS: int = 10 # the maximum of text updates per second, changeable in settings
+_RENDER_SINCE: dict = {} # source name -> time.perf_counter() when the event behind its queued text was received
+SINKS: list = [] # where rendered texts go: ObsSink inside OBS, files, a local page or stdout without it
+_RENDER_TASK: asyncio.Task | None = None # does what the OBS timer does when there's no OBS
+LATENCY: dict = {} # stage name -> LatencyHistogram of its durations since OBS launch
+_RECEIVED_AT: float | None = None # time.perf_counter() of the push message which is being processed now
+_RECORDER = None # RECORD_FILE opened for appending, only the census thread writes there
+# REST requests wait for a token of their host, the most important ones go first.
+# The same request asked a few times at once is sent once, all callers get its answer
+PRIORITY_ONLINE: int = 0 # what the screen needs now: characters, guns, stats of the shown character
+PRIORITY_NORMAL: int = 1 # stats of other online characters, missed kills, the shown leaderboard
+PRIORITY_BACKGROUND: int = 2 # leaderboard prefetch
+_BUCKETS: dict = {} # API host -> TokenBucket, they live on _LOOP
+_IN_FLIGHT: dict = {} # (url, query, headers) -> task of the request which is being sent
+REST_STATS: dict = {'sent': 0, 'merged': 0, 'throttled': 0} # REST requests since OBS launch
+
+
+# FUNCTIONS TO WORK WITH THE CACHE
+
+def cache_open() -> None:
+    """Opens the cache file next to the script, creates the table if needed.
+    The tracker works without the cache if the file can't be opened"""
+
+    global _CACHE
+    try:
+        _CACHE = sqlite3.connect(CACHE_FILE)
+        _CACHE.execute(
+            'CREATE TABLE IF NOT EXISTS cache (kind TEXT, key TEXT, value TEXT, stored REAL, PRIMARY KEY (kind, key))'
+        )
+        _CACHE.commit()
+    except sqlite3.Error as e:
+        print('<cache_open> cache is disabled:', e)
+        _CACHE = None
 
 
-# FUNCTIONS TO WORK WITH CENSUS!!
+def cache_close() -> None:
+    """Closes the cache file and shows how useful it was"""
+
+    global _CACHE
+    if _CACHE is not None:
+        _CACHE.close()
+        _CACHE = None
+    print(f'<cache_close> cache hits: {CACHE_STATS["hit"]}, misses: {CACHE_STATS["miss"]}')
+
 
-def get_online_char() -> None:
-    """Requests census with all characters from NAME_LIST. Fills NAMES_AND_IDS
-    with mappings of characters names and IDs, also changes CHAR_ONLINE
-    if any character is online"""
-
-    global CHAR_ONLINE, NAMES_AND_IDS
-    # params for census request
-    params = {
-        'name.first_lower': ','.join([ name.lower() for name in NAME_LIST ]),
-        'c:join': 'characters_online_status^on:character_id^to:character_id^inject_at:online',
-        'c:limit': len(NAME_LIST),
-    }
+def cache_get(kind: str, key: str):
+    """Returns a cached value if it is younger than the TTL of its kind, otherwise None"""
+
+    row = None
     try:
-        resp = get(URL + 'character_name', params=params).json()
-        # filling up NAMES_AND_IDS for sure and CHAR_ONLINE if any of them is online
-        for character in resp['character_name_list']:
-            NAMES_AND_IDS[character['name']['first']] = character['character_id']
-            if character['online']['online_status'] != '0':
-                CHAR_ONLINE = character['name']['first']
-    # there could be a few errors, in this situation it doesn't matter what happened
-    # matters that we didn't get the data. Character IDs are needed
-    except Exception as e:
-        print('Error occured:', e)
-
-
-def get_stats() -> dict:
-    """Requests census for stats of the currently online character,
-    looks for weapon_kills field and for any weapon from GUN_LIST"""
-    
-    def deep_get(d: dict | None, keys: list, default=None):
-        """
-        Gets a value from dicts with deep nesting or default
-        Example:
-            d = {'meta': {'status': 'OK', 'status_code': 200}}
-            deep_get(d, ['meta', 'status_code'])          # => 200
-            deep_get(d, ['garbage', 'status_code'])       # => None
-            deep_get(d, ['meta', 'garbage'], default='-') # => '-'
-        """
-        # Since we are getting nested field, we have to get the whole sequence of nested keys, at least list of two values
-        assert type(keys) is list
-        # if one of the keys in the list of keys is absent then the requested values is absebt. return default
-        if d is None:
-            return default
-        # If not keys anymore, then we found the needed value
-        if not keys:
-            return d
-        # recursive call of the same function with one level less nesting
-        return deep_get(d.get(keys[0]), keys[1:], default)
-
-    global CURRENT_GUN, KILLS, CURRENT_GUN_ID
-    # params for census request
-    params = {
-        'name.first': CHAR_ONLINE,
-        'c:resolve': 'weapon_stat_by_faction(stat_name,item_id,value_vs,value_tr,value_nc)',
-        'c:join': ['faction^inject_at:faction_name^show:code_tag',
-        'item^on:stats.weapon_stat_by_faction.item_id^to:item_id^inject_at:weapon_name^show:name.en',
-        ],
-    }
+        if _CACHE is not None:
+            row = _CACHE.execute('SELECT value, stored FROM cache WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+    except sqlite3.Error as e:
+        print('<cache_get> error occured:', e)
+    if row is None or time.time() - row[1] > CACHE_TTL[kind]:
+        CACHE_STATS['miss'] += 1
+        return None
+    CACHE_STATS['hit'] += 1
+    return json.loads(row[0])
+
+
+def cache_put(kind: str, values: dict) -> None:
+    """Saves all key-value pairs of the given kind at once"""
+
+    if _CACHE is None or not values:
+        return
+    now = time.time()
     try:
-        resp = get(URL + 'character', params=params).json()
-        if resp.get('returned'):
-            # weapon_stat_by_faction table returns a lot of records with different stats of different guns
-            # we take the first one (and hopefully the only one) which is named weapon_kills
-            # and has one of the listed in GUN_LIST guns
-            item = None
-            for item in resp['character_list'][0]['stats']['weapon_stat_by_faction']:
-                if deep_get(item, ['weapon_name', 'name', 'en']) in GUN_LIST and item.get('stat_name') == 'weapon_kills':
-                    break
-            # if the desired row was found
-            if item:
-                # removing teamkills from the stats
-                faction_tags = ['vs', 'tr', 'nc']
-                faction_tags.remove(resp['character_list'][0]['faction_name']['code_tag'].lower())
-                # preserving gun's name and ID
-                CURRENT_GUN = item['weapon_name']['name']['en']
-                CURRENT_GUN_ID = item['item_id']
-                # and summ total kills from kills on other two factions
-                KILLS = sum([ int(item.get('value_' + tag, 0)) for tag in faction_tags ])
-                print(f'<get_stats> {CURRENT_GUN} kills: {KILLS}')
-    # there could be a few errors, in this situation it doesn't matter what happened
-    # matters that we didn't get the data. Gun name, id and stats are needed
-    except Exception as e:
-        print('Error occured:', e)    
-
-
-def get_leaders() -> None:
-    """if CURRENT_GUN_ID is determined, requests voidwell api for
-    this guns leaderboard. Saves data to global variables"""
-    
-    # needs both values to determine what leaderboard to take ans up to what characetr
-    if not CURRENT_GUN_ID or not CHAR_ONLINE:
-        print('<get_leaders> cant retrieve leaders, the gun ID is absent or no characters online')
+        _CACHE.executemany(
+            'INSERT OR REPLACE INTO cache (kind, key, value, stored) VALUES (?, ?, ?, ?)',
+            [ (kind, key, json.dumps(value), now) for key, value in values.items() ],
+        )
+        _CACHE.commit()
+    except sqlite3.Error as e:
+        print('<cache_put> error occured:', e)
+
+
+# FOR LATENCY MEASUREMENT
+
+class LatencyHistogram:
+    """Histogram of durations with a fixed amount of buckets. Every bucket is 25% wider
+    than the previous one, from 10 microseconds up to about an hour, so percentiles
+    are precise to 25% and memory doesn't grow however long the stream is"""
+
+    __slots__ = ('counts', 'total')
+    BASE = 1e-5 # seconds, upper bound of the first bucket
+    GROWTH = 1.25
+    SIZE = 90
+
+    def __init__(self):
+        self.counts = [0] * self.SIZE
+        self.total = 0
+
+    def record(self, seconds: float) -> None:
+        if seconds <= self.BASE:
+            bucket = 0
+        else:
+            bucket = min(self.SIZE - 1, math.ceil(math.log(seconds / self.BASE, self.GROWTH)))
+        self.counts[bucket] += 1
+        self.total += 1
+
+    def percentile(self, percent: float) -> float:
+        """Returns the upper bound of the bucket where the percentile is, in seconds"""
+
+        rank = self.total * percent / 100
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.BASE * self.GROWTH ** bucket
+        return 0.0
+
+    def summary(self) -> str:
+        return ' '.join([ f'p{p} {self.percentile(p) * 1000:.3f}ms' for p in (50, 95, 99) ]) + f' (n={self.total})'
+
+
+def record_latency(stage: str, seconds: float) -> None:
+    """Puts a duration into the histogram of the stage"""
+
+    histogram = LATENCY.get(stage)
+    if histogram is None:
+        histogram = LATENCY[stage] = LatencyHistogram()
+    histogram.record(seconds)
+
+
+def latency_summary() -> str:
+    """Returns p50/p95/p99 of every stage, one stage per line"""
+
+    if not LATENCY:
+        return 'no measurements yet'
+    return '\n'.join([ f'{stage}: {histogram.summary()}' for stage, histogram in LATENCY.items() ])
+
+
+# FOR RECORDING OF CENSUS TRAFFIC
+
+def recorder_open() -> None:
+    """Opens RECORD_FILE if it's set. Every line there is a compact json object with
+    the wall time "t" and either a raw push message "ws" or a REST answer "rest"
+    with the request path and query in "key" """
+
+    global _RECORDER
+    if RECORD_FILE:
+        _RECORDER = open(RECORD_FILE, 'a', encoding='utf-8')
+
+
+def recorder_close() -> None:
+    global _RECORDER
+    if _RECORDER is not None:
+        _RECORDER.close()
+        _RECORDER = None
+
+
+def record(kind: str, data: str, key: str | None = None) -> None:
+    """Appends one push message or REST answer to RECORD_FILE"""
+
+    if _RECORDER is None:
         return
-    global LEADERS, GOAL_KILLS, CLOSEST_KILLS
-    # takes only page 0 by default. If CHAR_ONLINE is not on this page, then makes no sense to show the leaderboard
-    params = {
-        'page': 0,
-        'sort': 'kills',
-        'sortDir': 'desc',
-    }
+    entry = {'t': round(time.time(), 3), kind: data}
+    if key is not None:
+        entry['key'] = key
+    _RECORDER.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+
+# FOR THE LEADERBOARD
+
+class Leaderboard:
+    """Kills of other players on a gun leaderboard, kept in an array sorted by kills.
+    Every kill of the character finds its new place with a binary search, so it
+    can pass any amount of players at once. Rank, the next player to pass and
+    the gap to the top are computed on update, reading them costs nothing"""
+
+    __slots__ = ('char_name', 'gun_id', 'neg_kills', 'names', 'found', 'complete', 'own_kills', 'ahead')
+
+    def __init__(self, char_name: str, gun_id: str):
+        self.char_name = char_name
+        self.gun_id = gun_id
+        self.neg_kills = [] # negated kills, ascending, so the best player goes first
+        self.names = [] # names in the same order as neg_kills
+        self.found = False # the character was on the loaded pages
+        self.complete = False # all pages are loaded
+        self.own_kills = None
+        self.ahead = 0 # amount of loaded players with more kills than the character
+
+    def add_page(self, page: list) -> None:
+        """Adds a voidwell page of players, the character itself is skipped"""
+
+        pairs = list(zip(self.neg_kills, self.names))
+        for item in page:
+            if item.get('name') == self.char_name:
+                self.found = True
+                continue
+            pairs.append((-int(item.get('kills', 0)), item.get('name', 'n/a')))
+        # voidwell gives sorted pages, but it's cheap to be sure
+        pairs.sort()
+        self.neg_kills = [ pair[0] for pair in pairs ]
+        self.names = [ pair[1] for pair in pairs ]
+
+    def reached(self, own_kills: int | None) -> bool:
+        """True if loaded pages go down to the character, no need to load more"""
+
+        if self.found or self.complete:
+            return True
+        return own_kills is not None and bool(self.neg_kills) and -self.neg_kills[-1] < own_kills
+
+    def update(self, own_kills: int) -> None:
+        """Puts the character to its place according to its current kills"""
+
+        self.own_kills = own_kills
+        self.ahead = bisect_left(self.neg_kills, -own_kills)
+
+    @property
+    def rank(self) -> str:
+        """Place of the character, or the lowest known place if it's below the loaded pages"""
+
+        if self.ahead == len(self.neg_kills) and not self.reached(self.own_kills):
+            return f'>{self.ahead + 1}'
+        return str(self.ahead + 1)
+
+    @property
+    def next_target(self) -> tuple | None:
+        """(name, kills) of the player right above the character"""
+
+        if not self.ahead:
+            return None
+        return self.names[self.ahead - 1], -self.neg_kills[self.ahead - 1]
+
+    @property
+    def top_kills(self) -> int | None:
+        """Kills of the best player if it's not the character"""
+
+        return -self.neg_kills[0] if self.ahead else None
+
+    @property
+    def gap_to_top(self) -> int:
+        return -self.neg_kills[0] - self.own_kills if self.ahead else 0
+
+    def lines(self, limit: int) -> list:
+        """Players above the character and the character itself. If there are too many,
+        the best ones and the next target are shown, the rest is skipped"""
+
+        shown = range(self.ahead) if self.ahead <= limit else [*range(limit - 1), self.ahead - 1]
+        lines = []
+        for index in shown:
+            if lines and index == self.ahead - 1 and self.ahead > limit:
+                lines.append('...')
+            lines.append(f'{index + 1}. {self.names[index]} - {-self.neg_kills[index]} kills')
+        lines.append(f'{self.rank}. {self.char_name} - {self.own_kills} kills')
+        return lines
+
+
+def leaderboard_from_memory(char_name: str | None, gun_id: str | None):
+    """Builds the leaderboard of the character from pages in memory, however old
+    they are. Returns None if the gun leaderboard was never loaded"""
+
+    entry = _LEADERBOARDS.get(gun_id)
+    if entry is None or not char_name:
+        return None
+    board = Leaderboard(char_name, gun_id)
+    board.add_page([ item for page in entry['pages'] for item in page ])
+    board.complete = entry['complete']
+    return board
+
+
+def leaderboard_deep_enough(entry: dict, kills: int | None) -> bool:
+    """True if loaded pages go down to the given kills. Without kills the first page is enough"""
+
+    return entry['complete'] or kills is None or (entry['lowest'] is not None and entry['lowest'] < kills)
+
+
+# FOR SESSION METRICS
+
+class RollingCounter:
+    """Kills in time buckets of a ring with a fixed size. A kill costs one bucket increment,
+    old buckets are reused when the ring comes around, so memory doesn't depend
+    on how long the stream is. The ring covers the longest window, 15 minutes"""
+
+    __slots__ = ('buckets', 'stamps')
+    BUCKET = 10 # seconds, windows are precise to it
+    SIZE = 90
+
+    def __init__(self):
+        self.buckets = [0] * self.SIZE
+        self.stamps = [-1] * self.SIZE # number of the bucket since the epoch, tells if it's outdated
+
+    def add(self, timestamp: float) -> None:
+        stamp = int(timestamp // self.BUCKET)
+        index = stamp % self.SIZE
+        if self.stamps[index] != stamp:
+            # the kill is older than the ring, a backfilled one for example
+            if stamp < self.stamps[index]:
+                return
+            self.stamps[index] = stamp
+            self.buckets[index] = 0
+        self.buckets[index] += 1
+
+    def per_minute(self, seconds: float, now: float) -> float:
+        """Kills per minute over the last seconds"""
+
+        last = int(now // self.BUCKET)
+        first = last - int(seconds // self.BUCKET) + 1
+        kills = sum([ count for count, stamp in zip(self.buckets, self.stamps) if first <= stamp <= last ])
+        return kills * 60 / seconds
+
+
+class WeaponTable:
+    """Kills and vehicle kills of one character with every weapon, in arrays of counters.
+    An item ID gets its row once and is interned, so memory depends on how many weapons
+    were used and not on how many kills. After MAX_ROWS weapons the rest share one row"""
+
+    __slots__ = ('rows', 'item_ids', 'kills', 'vehicles')
+    MAX_ROWS = 2048
+    OTHER = 'other' # the shared row
+
+    def __init__(self):
+        self.rows = {} # item ID -> row
+        self.item_ids = [] # row -> item ID
+        self.kills = array('L')
+        self.vehicles = array('L')
+
+    def row(self, item_id: str) -> int:
+        row = self.rows.get(item_id)
+        if row is not None:
+            return row
+        if len(self.item_ids) >= self.MAX_ROWS:
+            item_id = self.OTHER
+            if item_id in self.rows:
+                return self.rows[item_id]
+        item_id = sys.intern(item_id)
+        row = self.rows[item_id] = len(self.item_ids)
+        self.item_ids.append(item_id)
+        self.kills.append(0)
+        self.vehicles.append(0)
+        return row
+
+    def add(self, item_id: str, vehicle: bool = False) -> None:
+        row = self.row(item_id or '0')
+        if vehicle:
+            self.vehicles[row] += 1
+        else:
+            self.kills[row] += 1
+
+    def top(self, n: int, vehicle: bool = False) -> list:
+        """(item ID, kills) of n weapons with most kills"""
+
+        column = self.vehicles if vehicle else self.kills
+        rows = heapq.nlargest(n, range(len(column)), key=column.__getitem__)
+        return [ (self.item_ids[row], column[row]) for row in rows if column[row] ]
+
+    def total(self, vehicle: bool = False) -> int:
+        return sum(self.vehicles if vehicle else self.kills)
+
+
+# FOR THE STATE SHOWN ON THE SCREEN
+
+class TrackerState:
+    """Everything the screen shows, in one object which never changes. The census
+    thread makes a new one after every change and swaps the reference, so a reader
+    on the OBS thread takes the state of a tracker once and sees consistent values without locks"""
+
+    __slots__ = (
+        'char_name', 'gun_name', 'gun_id', 'kills', 'rank', 'top_kills', 'leaders',
+        'kpm', 'streak', 'session', 'session_guns', 'next_target', 'top_weapons', 'vehicle_kills',
+    )
+
+    def __init__(
+        self,
+        char_name: str | None = None,
+        gun_name: str = 'n/a',
+        gun_id: str | None = None,
+        kills: int | str = 'n/a', # n/a because this will be shown on the screen
+        rank: str | None = None,
+        top_kills: int | None = None,
+        leaders: tuple | None = None, # leaderboard lines, empty if the character leads, None if not loaded
+        kpm: tuple = (0.0, 0.0, 0.0), # kills per minute over the last 1, 5 and 15 minutes
+        streak: int = 0,
+        session: int = 0, # kills with the shown gun since start
+        session_guns: tuple = (), # (gun name, kills since start) of all guns of the character
+        next_target: tuple | None = None, # (name, kills) of the player above on the leaderboard
+        top_weapons: tuple = (), # (weapon name, kills) with most kills this session
+        vehicle_kills: int = 0, # vehicles destroyed this session
+    ):
+        values = (
+            char_name, gun_name, gun_id, kills, rank, top_kills, leaders, kpm, streak, session, session_guns, next_target,
+            top_weapons, vehicle_kills,
+        )
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('TrackerState is never changed, make a new one')
+
+    def __repr__(self):
+        return f'TrackerState({", ".join([ f"{name}={getattr(self, name)!r}" for name in self.__slots__ ])})'
+
+
+# FOR TEMPLATES
+
+def leaderboard_text(state: TrackerState) -> str:
+    if state.leaders:
+        return '\n'.join(state.leaders)
+    if state.leaders is not None:
+        return f'The leader is {state.char_name}'
+    return 'The leaderboard was not loaded'
+
+
+# placeholder -> how its value is taken from a TrackerState
+TEMPLATE_FIELDS: dict = {
+    'char': lambda state: state.char_name or 'n/a',
+    'gun': lambda state: state.gun_name,
+    'kills': lambda state: state.kills,
+    'goal': lambda state: f'/{state.top_kills}' if state.top_kills else '',
+    'rank': lambda state: state.rank or 'n/a',
+    'kpm1': lambda state: state.kpm[0],
+    'kpm5': lambda state: state.kpm[1],
+    'kpm15': lambda state: state.kpm[2],
+    'streak': lambda state: state.streak,
+    'session': lambda state: state.session,
+    'session_guns': lambda state: ', '.join([ f'{gun_name} +{kills}' for gun_name, kills in state.session_guns ]),
+    'next_name': lambda state: state.next_target[0] if state.next_target else 'n/a',
+    'next_gap': lambda state: state.next_target[1] - state.kills if state.next_target else 0,
+    'top_gap': lambda state: state.top_kills - state.kills if state.top_kills else 0,
+    'leaderboard': leaderboard_text,
+    'top_weapons': lambda state: '\n'.join([ f'{name} {kills}' for name, kills in state.top_weapons ]),
+    'vehicle_kills': lambda state: state.vehicle_kills,
+}
+# format specs of placeholders written without one, like {kpm5}
+DEFAULT_SPECS: dict = {'kpm1': '.1f', 'kpm5': '.1f', 'kpm15': '.1f', 'session': '+d'}
+KPM_FIELDS: frozenset = frozenset(('kpm1', 'kpm5', 'kpm15'))
+
+
+def parse_template(template: str) -> tuple:
+    """Splits the template into (text, value getter, format spec) parts once, so rendering
+    doesn't parse it again. Returns the parts and the names of used placeholders.
+    Raises ValueError if the template is broken or has unknown placeholders"""
+
+    parts = []
+    fields = set()
+    for literal, field, spec, _ in string.Formatter().parse(template):
+        if field is None:
+            parts.append((literal, None, ''))
+        elif field in TEMPLATE_FIELDS:
+            parts.append((literal, TEMPLATE_FIELDS[field], spec or DEFAULT_SPECS.get(field, '')))
+            fields.add(field)
+        else:
+            raise ValueError(f'unknown placeholder {{{field}}}')
+    return tuple(parts), frozenset(fields)
+
+
+class Widget:
+    """A text source with its own template. Remembers its last text, so only
+    changed texts go to the screen"""
+
+    __slots__ = ('sources', 'parts', 'fields', 'default', 'text')
+
+    def __init__(self, sources: tuple | None, template: str, default: str = ''):
+        self.sources = sources # None means SOURCE and EXTRA_SOURCES
+        self.parts, self.fields = parse_template(template)
+        self.default = default # the template taken if this one fails on real values
+        self.text = None
+
+    def fill(self, state: TrackerState) -> str:
+        return ''.join([
+            literal + (fill_value(getter(state), spec) if getter else '') for literal, getter, spec in self.parts
+        ])
+
+    def format(self, state: TrackerState) -> str:
+        """Fills the template in. A template must never break the census loop,
+        if it fails the default one is taken for good"""
+
+        try:
+            return self.fill(state)
+        except (ValueError, TypeError) as e:
+            print(f'<Widget.format> the template failed: {e}, the default one is used')
+        try:
+            self.parts, self.fields = parse_template(self.default)
+            return self.fill(state)
+        except (ValueError, TypeError):
+            self.parts, self.fields = (), frozenset()
+            return ''
+
+    def render(self, state: TrackerState) -> str | None:
+        """Returns the new text, or None if it's the same as the last time"""
+
+        scripted_text = self.format(state)
+        if scripted_text == self.text:
+            return None
+        self.text = scripted_text
+        return scripted_text
+
+
+def fill_value(value, spec: str) -> str:
+    # n/a in place of a number is shown as it is, whatever the spec
+    try:
+        return format(value, spec)
+    except (ValueError, TypeError):
+        if isinstance(value, str):
+            return value
+        raise
+
+
+# a state with every value there, numbers are numbers. Templates are tried on it and on the empty one
+SAMPLE_STATE = TrackerState(
+    'sample', 'sample gun', '0', 1234, '2', 2000, ('#1 leader 2000',), (1.5, 1.0, 0.5), 3, 10,
+    (('sample gun', 10),), ('leader', 2000), (('sample gun', 10),), 1,
+)
+
+
+def make_widget(sources: tuple | None, template: str, default: str) -> Widget:
+    """A mistake in the template shouldn't leave the screen empty, the default one is taken then.
+    The template is filled in with the empty and the sample states, so a format spec which
+    doesn't fit its value, like {kills:s} or {kpm1:d}, is found here and not on the census thread"""
+
+    try:
+        widget = Widget(sources, template, default)
+        for state in (TrackerState(), SAMPLE_STATE):
+            widget.fill(state)
+        return widget
+    except (ValueError, TypeError) as e:
+        print(f'<make_widget> wrong template {template!r}: {e}, the default one is used')
+        return Widget(sources, default)
+
+
+def kpm_shown(widgets: tuple) -> bool:
+    """Kills per minute change without kills, such widgets need renewing from time to time"""
+
+    return any([ widget.fields & KPM_FIELDS for widget in widgets ])
+
+
+# FOR REST REQUESTS SCHEDULING
+
+class TokenBucket:
+    """Allows rate requests per second on average and burst at once. Requests
+    which have to wait are woken up in order of priority, then of arrival"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'waiters', 'timer')
+    _order = itertools.count() # keeps requests of the same priority in order of arrival
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.waiters = [] # heap of (priority, arrival, future)
+        self.timer = None # wakes up waiters when the next token is there
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self, priority: int) -> bool:
+        """Waits for a token. Returns True if the request had to wait"""
+
+        if not self.waiters and self.take():
+            return False
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self._order), future))
+        self.schedule()
+        await future
+        return True
+
+    def schedule(self) -> None:
+        if self.timer is None and self.waiters:
+            delay = max(0.0, (1 - self.tokens) / self.rate)
+            self.timer = asyncio.get_running_loop().call_later(delay, self.release)
+
+    def release(self) -> None:
+        self.timer = None
+        while self.waiters and self.take():
+            future = heapq.heappop(self.waiters)[2]
+            if future.cancelled():
+                # nobody waits for it anymore, the token goes back
+                self.tokens += 1
+                continue
+            future.set_result(None)
+        self.schedule()
+
+
+def get_bucket(url: str) -> TokenBucket:
+    host = urlsplit(url).hostname
+    bucket = _BUCKETS.get(host)
+    if bucket is None:
+        bucket = _BUCKETS[host] = TokenBucket(*REST_RATE_LIMITS.get(host, REST_RATE_DEFAULT))
+    return bucket
+
+
+def rest_summary() -> str:
+    """Returns a line with REST counters and requests waiting now"""
+
+    queued = sum([ len(bucket.waiters) for bucket in _BUCKETS.values() ])
+    return (f'REST sent: {REST_STATS["sent"]}, merged: {REST_STATS["merged"]}, '
+            f'throttled: {REST_STATS["throttled"]}, waiting now: {queued}')
+
+
+# FUNCTIONS TO WORK WITH CENSUS!!
+
+def get_session(url: str) -> aiohttp.ClientSession:
+    """Returns the http session for the host of the url. Every host gets
+    one session which keeps its connections alive, so census and voidwell
+    requests don't open a new TLS connection each time"""
+
+    host = urlsplit(url).netloc
+    session = _SESSIONS.get(host)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=4, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=REST_TIMEOUT),
+        )
+        _SESSIONS[host] = session
+    return session
+
+
+async def rest_get(
+    url: str,
+    params: dict,
+    timeout: float = REST_TIMEOUT,
+    stage: str = 'rest',
+    validators: dict | None = None,
+    priority: int = PRIORITY_NORMAL,
+):
+    """Makes a GET request on _LOOP without blocking it and returns the decoded json.
+    List values in params are sent as repeated keys. The duration goes to the stage histogram.
+    If validators are given, the request is conditional: ETag and Last-Modified of the previous
+    answer are sent and the new ones are put there. None means the answer didn't change.
+    The request waits for a token of its host, the same request which is sent already
+    isn't sent again, its answer is taken"""
+
+    query = []
+    for key, values in params.items():
+        for value in values if isinstance(values, list) else [values]:
+            query.append((key, str(value)))
+    headers = {}
+    if validators:
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'modified' in validators:
+            headers['If-Modified-Since'] = validators['modified']
+    key = (url, tuple(query), tuple(sorted(headers.items())))
+    shared = _IN_FLIGHT.get(key)
+    if shared is None:
+        shared = _IN_FLIGHT[key] = asyncio.ensure_future(rest_send(url, query, headers, timeout, stage, priority))
+        shared.add_done_callback(lambda _: _IN_FLIGHT.pop(key, None))
+    else:
+        REST_STATS['merged'] += 1
+    # a cancelled caller doesn't cancel the request for the others
+    text, new_validators = await asyncio.shield(shared)
+    if text is None:
+        return None
+    if validators is not None:
+        validators.clear()
+        validators.update(new_validators)
+    # every caller gets its own copy, callers change the answers sometimes
+    return json.loads(text)
+
+
+async def rest_send(url: str, query: list, headers: dict, timeout: float, stage: str, priority: int) -> tuple:
+    """Sends one request when its host allows. Returns the text and validators
+    of the answer, the text is None if the answer didn't change"""
+
+    queued = time.perf_counter()
+    if await get_bucket(url).acquire(priority):
+        REST_STATS['throttled'] += 1
+        record_latency('rest queue', time.perf_counter() - queued)
+    REST_STATS['sent'] += 1
+    started = time.perf_counter()
     try:
+        async with get_session(url).get(
+            url, params=query, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as resp:
+            if resp.status == 304:
+                return None, {}
+            # census answers with text/html content type sometimes, so don't check it
+            text = await resp.text()
+            validators = {}
+            if 'ETag' in resp.headers:
+                validators['etag'] = resp.headers['ETag']
+            if 'Last-Modified' in resp.headers:
+                validators['modified'] = resp.headers['Last-Modified']
+        record('rest', text, urlsplit(url).path + '?' + urlencode(query))
+        return text, validators
+    finally:
+        record_latency(stage, time.perf_counter() - started)
+
+
+async def close_sessions() -> None:
+    """Closes all http sessions. Must be called before _LOOP is closed"""
+
+    for session in _SESSIONS.values():
+        await session.close()
+    _SESSIONS.clear()
+
+
+def reconcile_summary() -> str:
+    """Returns a line with drift statistics"""
+
+    return (f'reconcile rounds: {RECONCILE_STATS["rounds"]}, counters checked: {RECONCILE_STATS["checked"]}, '
+            f'corrected: {RECONCILE_STATS["corrected"]} (+{RECONCILE_STATS["added"]}/-{RECONCILE_STATS["removed"]} kills), '
+            f'the largest drift: {RECONCILE_STATS["largest"]}')
+
+
+async def load_leaderboard(
+    gun_id: str, kills: int | None, priority: int = PRIORITY_NORMAL, max_age: float = LEADERBOARD_TTL,
+) -> dict | None:
+    """Returns pages of the gun leaderboard which go down to the given kills. Pages younger
+    than max_age are taken from memory. Old ones are asked again with conditional requests,
+    so voidwell sends only changed pages. Missing pages are loaded until the kills are reached"""
+
+    entry = _LEADERBOARDS.get(gun_id)
+    fresh = entry is not None and time.monotonic() - entry['stored'] < max_age
+    if fresh and leaderboard_deep_enough(entry, kills):
+        LEADERBOARD_STATS['memory'] += 1
+        return entry
+    if fresh:
+        # fresh pages stay as they are, only the deeper ones are loaded
+        new = dict(entry, pages=list(entry['pages']), validators=list(entry['validators']))
+    else:
+        new = {'pages': [], 'validators': [], 'complete': False, 'lowest': None, 'stored': time.monotonic()}
+    page_size = len(new['pages'][0]) if new['pages'] else None
+    while len(new['pages']) < MAX_LEADERBOARD_PAGES and not (new['pages'] and leaderboard_deep_enough(new, kills)):
+        page = len(new['pages'])
+        old = entry['pages'][page] if entry is not None and page < len(entry['pages']) else None
+        validators = dict(entry['validators'][page]) if old is not None else {}
+        params = {
+            'page': page,
+            'sort': 'kills',
+            'sortDir': 'desc',
+        }
         # request to voidewell. If fails - the algorithm will still work, but without the leaderboard
-        resp = get('https://api.voidwell.com/ps2/leaderboard/weapon/' + CURRENT_GUN_ID, params=params).json()
+        resp = await rest_get(
+            VOIDWELL_URL + gun_id, params, stage='rest get_leaders', validators=validators, priority=priority,
+        )
+        if resp is None:
+            # voidwell says the page is the same as the one in memory
+            LEADERBOARD_STATS['not_modified'] += 1
+            resp = old
         # it supposed to recieve a list
-        if not isinstance(resp, list):
-            print('<get_leaders> voidwell returned some shit, no leaderboard')
+        elif not isinstance(resp, list):
+            print(f'<load_leaderboard> voidwell returned some shit, no leaderboard for {gun_id}')
+            return None
+        else:
+            LEADERBOARD_STATS['downloaded'] += 1
+        new['pages'].append(resp)
+        new['validators'].append(validators)
+        # the first page tells how long pages are, a shorter one is the last
+        page_size = page_size or len(resp)
+        new['complete'] = not resp or len(resp) < page_size
+        if resp:
+            new['lowest'] = min([ int(item.get('kills', 0)) for item in resp ])
+    _LEADERBOARDS[gun_id] = new
+    return new
+
+
+def message_stats() -> str:
+    """Returns a line with processed and dropped messages of every kind"""
+
+    return ', '.join([ f'{kind} {processed}/{dropped}' for kind, (processed, dropped) in MESSAGE_STATS.items() ])
+
+
+# FOR THE TRACKER
+
+class Tracker:
+    """One kills counter: its characters and guns, counters, the shown leaderboard, background
+    tasks and the census connection. Everything here is changed only on the loop the tracker
+    runs on, so a few trackers may run in one process, on one loop or on a few. They share
+    only REST scheduling, the cache and leaderboard pages, which are the same for everybody.
+    The OBS thread reads only state, which is never changed, only replaced.
+    Widgets without sources go to SOURCE and EXTRA_SOURCES, so every tracker but the one
+    of the OBS script should have widgets with their own sources"""
+
+    __slots__ = (
+        'name', 'name_list', 'gun_list', 'push_url', 'widgets', 'kpm_shown', 'state', 'running',
+        'names_and_ids', 'ids_and_names', 'char_online', 'online_chars', 'current_gun', 'current_gun_id',
+        'kills', 'leaderboard', 'gun_item_ids', 'item_gun_names', 'char_factions',
+        'kill_index', 'kill_slots', 'slot_keys', 'session_kills', 'slot_rates', 'streaks',
+        'weapon_tables', 'unnamed_items', 'current_slot', 'census_seen',
+        'last_event_time', 'seen_events', 'seen_order', 'last_message_at',
+        'refresh_task', 'startup_task', 'backfill_task', 'backfill_since',
+        'census_task', 'prefetch_task', 'metrics_task', 'reconcile_task',
+    )
+
+    def __init__(
+        self,
+        name: str = 'obs', # tells trackers apart in the cache
+        name_list: list | None = None, # NAME_LIST if not given
+        gun_list: list | None = None, # GUN_LIST if not given
+        push_url: str | None = None, # PUSH_URL of the moment of connecting if not given
+        widgets: tuple | None = None, # the counter on SOURCE and EXTRA_SOURCES if not given
+    ):
+        self.name = name
+        self.name_list = list(name_list or NAME_LIST)
+        self.gun_list = list(gun_list or GUN_LIST)
+        self.push_url = push_url
+        self.set_widgets(widgets or (make_widget(None, TEXT_TEMPLATE, '{gun} kills: {kills}{goal}'),))
+        self.state = TrackerState() # what is shown on the screen now
+        self.running = False # allows or not to connect to census and receive messages
+        self.names_and_ids = {} # mapping of names and IDs. Census even streaming works only with IDs
+        self.ids_and_names = {} # reverse mapping of names_and_ids, events carry only IDs
+        self.char_online = None # a name from name_list which is currently online
+        self.online_chars = [] # all names from name_list which are online, in order of logging in
+        self.current_gun = None # a gun from gun_list which exists in char_online's stats
+        self.current_gun_id = None # the id of a current gun
+        self.kills = None # kills counter
+        self.leaderboard = None # Leaderboard of char_online with current_gun, None if it wasn't loaded
+        self.gun_item_ids = {} # gun name from gun_list -> list of its item IDs, one name may have a few items
+        self.item_gun_names = {} # reverse mapping of gun_item_ids, item ID -> gun name
+        self.char_factions = {} # character name -> census faction ID, found by weapon_kills
+        # kills dispatch table. Any death event costs one lookup in kill_index regardless
+        # of how many characters are online and how many guns are tracked
+        self.kill_index = {} # (attacker_character_id, attacker_weapon_id) -> slot in kill_slots
+        self.kill_slots = [] # kills counters of every tracked character and gun pair
+        self.slot_keys = [] # (character name, gun name, item ID for the leaderboard) of every slot
+        self.session_kills = [] # kills counted from events since start, per slot
+        self.slot_rates = [] # RollingCounter of every slot, for kills per minute
+        self.streaks = {} # character name -> kills with tracked guns since its last death
+        self.weapon_tables = {} # character name -> WeaponTable of this session, only with TRACK_ALL_WEAPONS
+        self.unnamed_items = set() # item IDs from weapon_tables which names weren't asked yet
+        self.current_slot = None # the slot of char_online and current_gun, the one shown on the screen
+        self.census_seen = {} # slot -> (census kills, drift) of the last reconcile, census may just be late
+        # after a reconnect only the kills made since the last event are requested. Kills which were
+        # seen already are recognized by their identity, so none of them is counted twice
+        self.last_event_time = None # census timestamp of the last processed event, None before the first connection
+        self.seen_events = set() # identities of the recently counted kills
+        self.seen_order = deque(maxlen=4096) # the same identities in order of arrival, the oldest ones are forgotten
+        self.last_message_at = 0.0 # time.monotonic() of the last message from the push service
+        self.refresh_task = None # fetches stats of a logged in character in background
+        self.startup_task = None # refresh_all after a cached start, logins and logouts don't cancel it
+        self.backfill_task = None # counts kills missed while the push connection was down
+        self.backfill_since = None # start of the gap which wasn't filled yet, survives a broken backfill
+        self.census_task = None # census_loop, the push connection and its reconnects
+        self.prefetch_task = None # renews leaderboard pages in background
+        self.metrics_task = None # renews kills per minute on the screen
+        self.reconcile_task = None # compares live counters with census stats
+
+    def set_widgets(self, widgets: tuple) -> None:
+        """The counter, the goal and the leaderboard sources with their parsed templates.
+        Replaced as a whole, the counter goes first"""
+
+        self.widgets = widgets
+        self.kpm_shown = kpm_shown(widgets) # some template has {kpm1}, {kpm5} or {kpm15}
+
+    # FOR THE CACHE
+
+    def cache_kills(self) -> None:
+        """Saves counters of the kills dispatch table and the character on the screen"""
+
+        kills = {}
+        for slot, (name, gun_name, gun_id) in enumerate(self.slot_keys):
+            kills.setdefault(name.lower(), []).append([gun_name, gun_id, self.kill_slots[slot]])
+        cache_put('kills', kills)
+        if self.char_online:
+            cache_put('shown', {self.name: self.char_online})
+
+    def load_cached_gun_ids(self) -> list:
+        """Fills gun_item_ids from the cache, returns guns which weren't found there"""
+
+        missing = []
+        for gun_name in self.gun_list:
+            if gun_name in self.gun_item_ids:
+                continue
+            item_ids = cache_get('gun_id', gun_name)
+            if item_ids is None:
+                missing.append(gun_name)
+                continue
+            self.gun_item_ids[gun_name] = item_ids
+            for item_id in item_ids:
+                self.item_gun_names[item_id] = gun_name
+        return missing
+
+    def load_cached(self) -> bool:
+        """Fills character IDs, gun IDs and the kills dispatch table from the cache and puts
+        the last shown character on the screen. Returns False if any character from
+        name_list is missing, then everything has to be requested from census first"""
+
+        chars = {}
+        for name in self.name_list:
+            char = cache_get('char_id', name.lower())
+            if char is None:
+                print(f'<load_cached> hits: {CACHE_STATS["hit"]}, misses: {CACHE_STATS["miss"]}')
+                return False
+            chars[char[0]] = char[1]
+        self.load_cached_gun_ids()
+        for name, char_id in chars.items():
+            self.names_and_ids[name] = char_id
+            self.ids_and_names[char_id] = name
+            for gun_name, gun_id, value in cache_get('kills', name.lower()) or []:
+                # counters of guns without known item IDs can't get events anyway
+                if gun_name in self.gun_item_ids:
+                    self.track_kills(name, gun_name, gun_id, value)
+        shown = cache_get('shown', self.name)
+        if shown in self.names_and_ids:
+            self.show_slot(self.shown_slot(shown))
+        print(f'<load_cached> hits: {CACHE_STATS["hit"]}, misses: {CACHE_STATS["miss"]}')
+        return True
+
+    # FOR THE KILLS DISPATCH TABLE
+
+    def track_kills(self, char_name: str, gun_name: str, gun_id: str, kills: int) -> int:
+        """Puts a character and gun pair into the kills dispatch table, or renews its
+        counter if the pair is there already. All item IDs of the gun point to the
+        same slot, gun_id is the one its leaderboard is taken for. Returns the slot"""
+
+        char_id = self.names_and_ids[char_name]
+        slot = self.kill_index.get((char_id, gun_id))
+        if slot is None:
+            slot = len(self.kill_slots)
+            self.kill_slots.append(kills)
+            self.slot_keys.append((char_name, gun_name, gun_id))
+            self.session_kills.append(0)
+            self.slot_rates.append(RollingCounter())
+            for item_id in self.gun_item_ids.get(gun_name, [gun_id]):
+                self.kill_index[(char_id, item_id)] = slot
+        else:
+            self.kill_slots[slot] = kills
+            self.slot_keys[slot] = (char_name, gun_name, gun_id)
+        return slot
+
+    def reset_kill_index(self) -> None:
+        """Empties the kills dispatch table. Slots are never removed one by one,
+        the table can't grow over len(name_list) * len(gun_list) anyway"""
+
+        self.kill_index.clear()
+        self.kill_slots.clear()
+        self.slot_keys.clear()
+        self.session_kills.clear()
+        self.slot_rates.clear()
+        self.streaks.clear()
+        self.weapon_tables.clear()
+        self.census_seen.clear()
+        self.current_slot = None
+
+    def shown_slot(self, char_name: str) -> int | None:
+        """Returns the slot of the character which goes on the screen. If the
+        character has kills with a few guns, the first one from gun_list wins"""
+
+        slots = { gun_name: slot for slot, (name, gun_name, _) in enumerate(self.slot_keys) if name == char_name }
+        for gun_name in self.gun_list:
+            if gun_name in slots:
+                return slots[gun_name]
+        return None
+
+    def show_slot(self, slot: int | None) -> None:
+        """Puts the character, the gun and the kills of the slot on the screen"""
+
+        if slot is None:
+            return
+        self.char_online, self.current_gun, self.current_gun_id = self.slot_keys[slot]
+        self.current_slot = slot
+        self.kills = self.kill_slots[slot]
+        # the leaderboard of another character or gun is taken from memory, no waiting for voidwell
+        board = self.leaderboard
+        if board is None or (board.char_name, board.gun_id) != (self.char_online, self.current_gun_id):
+            self.leaderboard = leaderboard_from_memory(self.char_online, self.current_gun_id)
+        self.leaderboard_update()
+
+    def values_to_default(self) -> None:
+        """When a character logged off or census connection was lot,
+        all changed values should get the default state and
+        the algoritm begins to work from the scratch"""
+
+        self.kills = self.current_gun = 'n/a' # n/a because this will be shown on the screen
+        self.current_gun_id = self.char_online = self.leaderboard = self.current_slot = None
+        self.publish_state()
+
+    # FOR THE LEADERBOARD
+
+    def leaderboard_update(self) -> None:
+        """Moves char_online on the leaderboard to its current kills"""
+
+        board = self.leaderboard
+        if (
+            board is not None and isinstance(self.kills, int)
+            and (board.char_name, board.gun_id) == (self.char_online, self.current_gun_id)
+        ):
+            board.update(self.kills)
+
+    def lowest_tracked_kills(self, gun_id: str) -> int | None:
+        """The least kills of tracked characters with the gun, its leaderboard has to go down to them"""
+
+        kills = [
+            self.kill_slots[slot] for slot, (_, _, slot_gun_id) in enumerate(self.slot_keys) if slot_gun_id == gun_id
+        ]
+        return min(kills) if kills else None
+
+    async def get_leaders(self, gun_id: str | None = None) -> None:
+        """if current_gun_id (or the given gun_id) is determined, puts its leaderboard
+        on the screen. Pages come from memory or from voidwell until the character is reached"""
+
+        gun_id = gun_id or self.current_gun_id
+        # needs both values to determine what leaderboard to take ans up to what characetr
+        if not gun_id or not self.char_online:
+            print('<get_leaders> cant retrieve leaders, the gun ID is absent or no characters online')
             return
-        # record only names and kills into the resulting list
-        # stop when got 10 records or found our CHAR_ONLINE
-        for num, item in enumerate(resp):
-            if len(LEADERS):
-                CLOSEST_KILLS = LEADERS[-1][1]
-            LEADERS.append((item.get('name', 'n/a'), item.get('kills', 0)))
-            if num > 10:
+        try:
+            if await load_leaderboard(gun_id, self.kills if isinstance(self.kills, int) else None) is None:
+                return
+            # the board is swapped as a whole, the websocket reader may look at it meanwhile
+            self.leaderboard = leaderboard_from_memory(self.char_online, gun_id)
+            self.leaderboard_update()
+        # there could be a few errors, in this situation it doesn't matter what happened
+        # matters that we didn't get the data. Gun name, id and stats are needed
+        except Exception as e:
+            print('Error occured:', e)
+
+    async def prefetch_leaderboards(self) -> None:
+        """Keeps leaderboards of all items from gun_list in memory. Guns of tracked
+        characters go first. Requests go one by one with pauses, they never hurry"""
+
+        while True:
+            tracked = [ gun_id for _, _, gun_id in self.slot_keys ]
+            others = [ item_id for gun_name in self.gun_list for item_id in self.gun_item_ids.get(gun_name, []) ]
+            gun_ids = [ gun_id for gun_id in dict.fromkeys([self.current_gun_id, *tracked, *others]) if gun_id ]
+            if not gun_ids:
+                # on a cold start gun IDs come a bit later, a whole LEADERBOARD_REFRESH is too long to wait
+                await asyncio.sleep(LEADERBOARD_PREFETCH_PAUSE)
+                continue
+            for gun_id in gun_ids:
+                try:
+                    # boards which foreground requests loaded meanwhile are renewed too,
+                    # otherwise every other round would come from memory
+                    entry = await load_leaderboard(
+                        gun_id, self.lowest_tracked_kills(gun_id), PRIORITY_BACKGROUND, max_age=LEADERBOARD_REFRESH,
+                    )
+                except Exception as e:
+                    print(f'<prefetch_leaderboards> leaderboard of {gun_id} wasnt renewed:', e)
+                    entry = None
+                # the board on the screen is renewed with its pages
+                if entry is not None and gun_id == self.current_gun_id and self.char_online:
+                    self.leaderboard = leaderboard_from_memory(self.char_online, gun_id)
+                    self.leaderboard_update()
+                    self.show_state()
+                await asyncio.sleep(LEADERBOARD_PREFETCH_PAUSE)
+            await asyncio.sleep(LEADERBOARD_REFRESH)
+
+    # FOR SESSION METRICS
+
+    def count_metrics(self, slot: int, payload: dict) -> None:
+        """Counts a kill of the slot in its session kills, kills per minute and the streak of the character"""
+
+        self.session_kills[slot] += 1
+        timestamp = payload.get('timestamp')
+        self.slot_rates[slot].add(int(timestamp) if timestamp else time.time())
+        name = self.slot_keys[slot][0]
+        self.streaks[name] = self.streaks.get(name, 0) + 1
+
+    def count_weapon(self, char_id: str, item_id: str, vehicle: bool = False) -> None:
+        name = self.ids_and_names[char_id]
+        table = self.weapon_tables.get(name)
+        if table is None:
+            table = self.weapon_tables[name] = WeaponTable()
+        rows = len(table.item_ids)
+        table.add(item_id, vehicle)
+        # a weapon which got its own row is shown by its name some time
+        if len(table.item_ids) > rows:
+            item_id = table.item_ids[-1]
+            if item_id not in ITEM_NAMES and item_id not in self.item_gun_names and item_id != table.OTHER:
+                self.unnamed_items.add(item_id)
+
+    def top_weapons(self, char_name: str | None, n: int = TOP_WEAPONS, vehicle: bool = False) -> list:
+        """(weapon name, kills) of n weapons the character killed most with this session"""
+
+        table = self.weapon_tables.get(char_name)
+        if table is None:
+            return []
+        return [
+            (ITEM_NAMES.get(item_id) or self.item_gun_names.get(item_id, item_id), kills)
+            for item_id, kills in table.top(n, vehicle)
+        ]
+
+    async def metrics_tick(self) -> None:
+        """Kills per minute go down without kills too, so the screen is renewed from time to time.
+        Names of new weapons in weapon_tables are asked here too"""
+
+        while True:
+            await asyncio.sleep(METRICS_REFRESH)
+            if self.unnamed_items and await self.get_item_names():
+                self.show_state()
+            elif self.current_slot is not None and self.kpm_shown:
+                self.show_state()
+
+    async def get_item_names(self) -> bool:
+        """Finds names of weapons which were seen in kills, from the cache or from census.
+        Returns True if any name was found"""
+
+        item_ids = list(self.unnamed_items)[:100]
+        self.unnamed_items.difference_update(item_ids)
+        missing = []
+        for item_id in item_ids:
+            name = ITEM_NAMES.get(item_id) or cache_get('item_name', item_id)
+            if name is None:
+                missing.append(item_id)
+            else:
+                ITEM_NAMES[item_id] = name
+        if missing:
+            # params for census request
+            params = {
+                'item_id': ','.join(missing),
+                'c:show': 'item_id,name.en',
+                'c:limit': len(missing),
+            }
+            try:
+                resp = await rest_get(URL + 'item', params, stage='rest get_item_names', priority=PRIORITY_BACKGROUND)
+                found = { item['item_id']: item.get('name', {}).get('en', item['item_id']) for item in resp.get('item_list', []) }
+                ITEM_NAMES.update(found)
+                cache_put('item_name', found)
+            # there could be a few errors, in this situation it doesn't matter what happened
+            # matters that we didn't get the data. IDs are shown instead of names then
+            except Exception as e:
+                print('Error occured:', e)
+        return any([ item_id in ITEM_NAMES for item_id in item_ids ])
+
+    # FOR THE STATE SHOWN ON THE SCREEN
+
+    def publish_state(self) -> None:
+        """Makes a snapshot of the shown values and puts it into state. Called on the loop of the tracker only"""
+
+        slot = self.current_slot
+        if slot is not None:
+            now = time.time()
+            kpm = tuple([ self.slot_rates[slot].per_minute(minutes * 60, now) for minutes in (1, 5, 15) ])
+            session_guns = tuple([
+                (gun_name, self.session_kills[other])
+                for other, (name, gun_name, _) in enumerate(self.slot_keys) if name == self.char_online
+            ])
+        board = self.leaderboard
+        if (
+            board is None or board.own_kills is None
+            or (board.char_name, board.gun_id) != (self.char_online, self.current_gun_id)
+        ):
+            board = None
+        table = self.weapon_tables.get(self.char_online)
+        self.state = TrackerState(
+            self.char_online,
+            self.current_gun,
+            self.current_gun_id,
+            self.kills,
+            board.rank if board else None,
+            board.top_kills if board else None,
+            (tuple(board.lines(LEADERBOARD_LINES)) if board.ahead else ()) if board else None,
+            *(
+                (kpm, self.streaks.get(self.char_online, 0), self.session_kills[slot], session_guns)
+                if slot is not None else ()
+            ),
+            next_target=board.next_target if board else None,
+            top_weapons=tuple(self.top_weapons(self.char_online)) if TRACK_ALL_WEAPONS else (),
+            vehicle_kills=table.total(vehicle=True) if table is not None else 0,
+        )
+
+    def show_state(self) -> None:
+        """Publishes the current values and queues the texts which changed for the screen"""
+
+        self.publish_state()
+        state = self.state
+        for widget in self.widgets:
+            scripted_text = widget.render(state)
+            if scripted_text is None:
+                continue
+            if widget.sources is None:
+                update_outputs(scripted_text)
+            else:
+                for text_source in widget.sources:
+                    update_text(text_source, scripted_text)
+
+    # FOR CENSUS REST REQUESTS
+
+    async def get_online_char(self) -> list | None:
+        """Requests census with all characters from name_list. Fills names_and_ids
+        with mappings of characters names and IDs. Returns names of online characters,
+        the callers decide what to do with them. None if census didn't answer"""
+
+        # params for census request
+        params = {
+            'name.first_lower': ','.join([ name.lower() for name in self.name_list ]),
+            'c:join': 'characters_online_status^on:character_id^to:character_id^inject_at:online',
+            'c:limit': len(self.name_list),
+        }
+        try:
+            resp = await rest_get(URL + 'character_name', params, stage='rest get_online_char', priority=PRIORITY_ONLINE)
+            # filling up names_and_ids for sure and the list if any of them is online
+            online = []
+            for character in resp['character_name_list']:
+                self.names_and_ids[character['name']['first']] = character['character_id']
+                self.ids_and_names[character['character_id']] = character['name']['first']
+                if character['online']['online_status'] != '0':
+                    online.append(character['name']['first'])
+            cache_put('char_id', { name.lower(): [name, char_id] for name, char_id in self.names_and_ids.items() })
+            return online
+        # there could be a few errors, in this situation it doesn't matter what happened
+        # matters that we didn't get the data. Character IDs are needed
+        except Exception as e:
+            print('Error occured:', e)
+            return None
+
+    async def get_gun_ids(self) -> None:
+        """Finds item IDs of all guns from gun_list. Census is asked only about
+        the guns which aren't in memory or in the cache, so it happens once"""
+
+        missing = self.load_cached_gun_ids()
+        if not missing:
+            return
+        # params for census request
+        params = {
+            'name.en': ','.join(missing),
+            'c:show': 'item_id,name.en',
+            'c:limit': 100,
+        }
+        try:
+            resp = await rest_get(URL + 'item', params, stage='rest get_gun_ids', priority=PRIORITY_ONLINE)
+            for item in resp['item_list']:
+                self.gun_item_ids.setdefault(item['name']['en'], []).append(item['item_id'])
+                self.item_gun_names[item['item_id']] = item['name']['en']
+            cache_put('gun_id', {
+                gun_name: self.gun_item_ids[gun_name] for gun_name in missing if gun_name in self.gun_item_ids
+            })
+            for gun_name in missing:
+                if gun_name not in self.gun_item_ids:
+                    print(f'<get_gun_ids> census doesnt know the gun {gun_name}, check its name')
+        # there could be a few errors, in this situation it doesn't matter what happened
+        # matters that we didn't get the data. Gun IDs are needed
+        except Exception as e:
+            print('Error occured:', e)
+
+    async def get_stats(self, char_name: str | None = None) -> None:
+        """Requests census for weapon_kills of the given or the currently online character,
+        only the rows of guns from gun_list. Every gun gets its counter, values of
+        the current gun are changed only for char_online"""
+
+        char_name = char_name or self.char_online
+        # both are needed to ask only for the rows we need
+        if char_name not in self.names_and_ids or not self.item_gun_names:
+            print(f'<get_stats> cant retrieve stats of {char_name}, character ID or gun IDs are absent')
+            return
+        try:
+            # the shown character goes before the others and before leaderboards
+            priority = PRIORITY_ONLINE if char_name == self.char_online else PRIORITY_NORMAL
+            kills, gun_ids = await self.weapon_kills(char_name, priority, 'rest get_stats')
+            if not kills:
+                print(f'<get_stats> {char_name} has no kills with guns from gun_list')
+                return
+            for gun_name, value in kills.items():
+                self.track_kills(char_name, gun_name, gun_ids[gun_name], value)
+            cache_put('kills', {
+                char_name.lower(): [ [gun_name, gun_ids[gun_name], value] for gun_name, value in kills.items() ]
+            })
+            # preserving gun's name and ID, if this character is shown on the screen
+            if char_name == self.char_online:
+                self.show_slot(self.shown_slot(char_name))
+                cache_put('shown', {self.name: char_name})
+            print(f'<get_stats> {char_name} kills: ' + ', '.join([ f'{gun_name} {value}' for gun_name, value in kills.items() ]))
+        # there could be a few errors, in this situation it doesn't matter what happened
+        # matters that we didn't get the data. Gun name, id and stats are needed
+        except Exception as e:
+            print('Error occured:', e)
+
+    async def weapon_kills(self, char_name: str, priority: int, stage: str) -> tuple:
+        """Requests census weapon_kills of the character, only the rows of guns from gun_list.
+        Returns gun name -> kills without teamkills and gun name -> the item ID with most kills"""
+
+        # params for census request
+        params = {
+            'character_id': self.names_and_ids[char_name],
+            'stat_name': 'weapon_kills',
+            'item_id': ','.join(self.item_gun_names),
+            'c:show': 'character_id,item_id,value_vs,value_nc,value_tr',
+            'c:join': 'character^inject_at:character^show:faction_id',
+            'c:limit': 100,
+        }
+        resp = await rest_get(URL + 'characters_weapon_stat_by_faction', params, stage=stage, priority=priority)
+        rows = resp.get('characters_weapon_stat_by_faction_list')
+        if not rows:
+            return {}, {}
+        # removing teamkills from the stats
+        faction_tags = ['vs', 'nc', 'tr']
+        self.char_factions[char_name] = rows[0].get('character', {}).get('faction_id')
+        own_tag = FACTION_TAGS.get(self.char_factions[char_name])
+        if own_tag:
+            faction_tags.remove(own_tag)
+        # a gun may have a few item IDs, kills of all of them are summed up. The leaderboard
+        # is taken for the item with the most kills
+        kills = {}
+        gun_ids = {}
+        best = {}
+        for row in rows:
+            gun_name = self.item_gun_names.get(row['item_id'])
+            if gun_name is None:
+                continue
+            # summ total kills from kills on other two factions
+            value = sum([ int(row.get('value_' + tag, 0)) for tag in faction_tags ])
+            kills[gun_name] = kills.get(gun_name, 0) + value
+            if value > best.get(gun_name, -1):
+                best[gun_name] = value
+                gun_ids[gun_name] = row['item_id']
+        return kills, gun_ids
+
+    async def get_kills_since(self, char_name: str, since: int) -> list:
+        """Requests kills of the character made after the census timestamp. Rows of
+        characters_event look like Death payloads of the push service, but have no
+        teams, so factions are put there instead for the teamkill filter. Errors go
+        to the caller, a part of the kills would look like the whole gap"""
+
+        rows = []
+        before = None
+        while True:
+            # params for census request
+            params = {
+                'character_id': self.names_and_ids[char_name],
+                'type': 'KILL',
+                'after': since,
+                'c:limit': BACKFILL_PAGE,
+                'c:join': 'character^inject_at:victim^show:faction_id',
+            }
+            if before is not None:
+                params['before'] = before
+            resp = await rest_get(URL + 'characters_event', params, stage='rest get_kills_since')
+            page = resp.get('characters_event_list', [])
+            for row in page:
+                row.setdefault('attacker_team_id', self.char_factions.get(char_name))
+                row.setdefault('team_id', row.get('victim', {}).get('faction_id'))
+            rows += page
+            if len(page) < BACKFILL_PAGE:
                 break
-            if item.get('name', 'n/a') == CHAR_ONLINE:
+            # newest kills go first, the next page is older than the last row. The same
+            # second is requested once more, event_seen throws away the repeated kills
+            before = int(page[-1]['timestamp']) + 1
+        return rows
+
+    # FOR RECONCILING WITH CENSUS STATS
+
+    async def reconcile_char(self, char_name: str) -> int:
+        """Compares live counters of the character with census stats and adds the difference.
+        Census is taken as it is when it has more kills. When it has less, it may be just late,
+        so the counter goes down only if census has changed since the last time and the difference
+        stayed the same. Census moved by exactly as many kills as were counted live, so it isn't
+        catching up, the live counter has too many. Otherwise catching up census would take kills back.
+        Slots which got kills during the request are left for the next time. Returns corrections"""
+
+        live = list(self.kill_slots)
+        kills, gun_ids = await self.weapon_kills(char_name, PRIORITY_BACKGROUND, 'rest reconcile')
+        char_id = self.names_and_ids[char_name]
+        corrected = 0
+        for gun_name, value in kills.items():
+            slot = self.kill_index.get((char_id, gun_ids[gun_name]))
+            if slot is None:
+                # the first kills with this gun, the counter is new anyway
+                self.track_kills(char_name, gun_name, gun_ids[gun_name], value)
+                continue
+            if slot >= len(live) or self.kill_slots[slot] != live[slot]:
+                continue
+            RECONCILE_STATS['checked'] += 1
+            drift = value - live[slot]
+            seen = self.census_seen.get(slot)
+            self.census_seen[slot] = (value, drift)
+            if drift < 0 and (seen is None or seen[0] == value or seen[1] != drift):
+                continue
+            if not drift:
+                continue
+            self.kill_slots[slot] += drift
+            corrected += 1
+            RECONCILE_STATS['corrected'] += 1
+            RECONCILE_STATS['added' if drift > 0 else 'removed'] += abs(drift)
+            RECONCILE_STATS['largest'] = max(RECONCILE_STATS['largest'], abs(drift))
+            print(f'<reconcile_char> {char_name} {gun_name}: live {live[slot]}, census {value}, corrected by {drift:+}')
+            if slot == self.current_slot:
+                self.show_slot(slot)
+                self.show_state()
+        return corrected
+
+    async def reconcile_loop(self) -> None:
+        """Checks live counters of online characters against census from time to time. Waits are
+        short after a correction and grow twice while nobody is online or nobody kills"""
+
+        interval = RECONCILE_MIN
+        last_total = None
+        while True:
+            await asyncio.sleep(interval)
+            chars = [ name for name in self.online_chars if name in self.names_and_ids ]
+            total = sum(self.session_kills)
+            idle = total == last_total
+            last_total = total
+            if not chars:
+                interval = min(RECONCILE_MAX, interval * 2)
+                continue
+            RECONCILE_STATS['rounds'] += 1
+            corrected = 0
+            for name in chars:
+                try:
+                    corrected += await self.reconcile_char(name)
+                except Exception as e:
+                    print(f'<reconcile_loop> {name} wasnt checked:', e)
+            if corrected:
+                interval = RECONCILE_MIN
+            elif idle:
+                interval = min(RECONCILE_MAX, interval * 2)
+
+    # FOR LOGINS AND STATS REFRESHING
+
+    async def refresh_online_char(self) -> None:
+        """Fetches stats and the leaderboard of char_online. If the gun of the character
+        is known from a previous login, both requests go at the same time. Otherwise
+        the leaderboard has to wait until get_stats finds the gun"""
+
+        known_slot = self.shown_slot(self.char_online)
+        known_gun_id = self.slot_keys[known_slot][2] if known_slot is not None else None
+        if known_gun_id:
+            await asyncio.gather(self.get_stats(), self.get_leaders(known_gun_id))
+            # the character changed the gun since then, the leaderboard is of a wrong gun
+            if self.current_gun_id and self.current_gun_id != known_gun_id:
+                await self.get_leaders()
+        else:
+            await self.get_stats()
+            await self.get_leaders()
+
+    async def refresh_all(self) -> None:
+        """Requests online status of all characters, then stats of the online ones.
+        If the character on the screen came from the cache and is offline now, it's removed.
+        Logins and logouts which come meanwhile are newer than the census answer, they stay"""
+
+        shown = self.char_online
+        before = set(self.online_chars)
+        # stats requests need both characters and guns IDs
+        online, _ = await asyncio.gather(self.get_online_char(), self.get_gun_ids())
+        changed = before ^ set(self.online_chars)
+        self.online_chars[:] = [ name for name in self.online_chars if name in changed ] + [
+            name for name in online or [] if name not in changed
+        ]
+        if self.char_online != shown:
+            # a live login or logout has decided what is on the screen, login_refresh fetches its stats
+            await asyncio.gather(*[ self.get_stats(name) for name in self.online_chars if name != self.char_online ])
+            self.show_state()
+            return
+        if shown not in self.online_chars:
+            if shown is not None:
+                # the cached numbers belong to a character which is offline now
+                self.values_to_default()
+            # the last online character goes on the screen
+            self.char_online = self.online_chars[-1] if self.online_chars else None
+        if self.char_online:
+            # the character on the screen needs the leaderboard too, other online ones only counters
+            await asyncio.gather(
+                self.refresh_online_char(),
+                *[ self.get_stats(name) for name in self.online_chars if name != self.char_online ],
+            )
+        self.show_state()
+
+    async def login_refresh(self, census) -> None:
+        """Runs as a separate task, so the websocket reader keeps receiving events
+        while stats of a logged in character are requested"""
+
+        # gun IDs may be still on their way after a cached start
+        if self.startup_task is not None and not self.startup_task.done():
+            await asyncio.wait([self.startup_task])
+        await self.refresh_online_char()
+        self.show_state()
+        if not self.current_gun_id:
+            self.running = False
+            print('<login_refresh> couldnt retrieve the current gun ID, please restart')
+            await census.close()
+
+    def cancel_refresh(self) -> None:
+        """Cancels stats requests of a character which is not online anymore"""
+
+        if self.refresh_task is not None and not self.refresh_task.done():
+            self.refresh_task.cancel()
+        self.refresh_task = None
+
+    # FOR EVENTS
+
+    def event_seen(self, payload: dict) -> bool:
+        """Remembers the identity of a kill. Returns True if it was seen already"""
+
+        key = (
+            payload.get('timestamp'),
+            payload.get('attacker_character_id'),
+            payload.get('character_id'),
+            payload.get('attacker_weapon_id'),
+            # a vehicle and its driver may be killed with one shot
+            payload.get('vehicle_id'),
+        )
+        if key in self.seen_events:
+            return True
+        # deque drops the oldest identity by itself, the set has to forget it too
+        if len(self.seen_order) == self.seen_order.maxlen:
+            self.seen_events.discard(self.seen_order[0])
+        self.seen_order.append(key)
+        self.seen_events.add(key)
+        return False
+
+    def note_event_time(self, payload: dict) -> None:
+        """Moves last_event_time forward to the census timestamp of the event"""
+
+        timestamp = int(payload.get('timestamp') or 0)
+        if self.last_event_time is None or timestamp > self.last_event_time:
+            self.last_event_time = timestamp
+
+    def on_death(self, payload: dict) -> None:
+        """Counts a kill if the attacker and the weapon are in the kills dispatch table.
+        Teamkills and kills which were counted already aren't counted. Only the slot
+        shown on the screen renews the text. A death of a tracked character ends its streak"""
+
+        victim = self.ids_and_names.get(payload.get('character_id'))
+        if victim is not None and self.streaks.get(victim):
+            self.streaks[victim] = 0
+            if victim == self.char_online:
+                self.show_state()
+        attacker_id = payload.get('attacker_character_id')
+        weapon_id = payload.get('attacker_weapon_id')
+        slot = self.kill_index.get((attacker_id, weapon_id))
+        if slot is None and not (TRACK_ALL_WEAPONS and attacker_id in self.ids_and_names):
+            return
+        team_id = payload.get('team_id')
+        if team_id is not None and team_id == payload.get('attacker_team_id'):
+            return
+        if self.event_seen(payload):
+            return
+        if TRACK_ALL_WEAPONS:
+            self.count_weapon(attacker_id, weapon_id)
+            if slot is None:
+                if self.ids_and_names[attacker_id] == self.char_online:
+                    self.show_state()
+                return
+        self.kill_slots[slot] += 1
+        self.count_metrics(slot, payload)
+        if slot != self.current_slot:
+            print(f'<on_death> {self.slot_keys[slot][0]} {self.slot_keys[slot][1]} +1 kill = {self.kill_slots[slot]}')
+            return
+        self.kills = self.kill_slots[slot]
+        print(f'<on_death> +1 kill = {self.kills}')
+        self.leaderboard_update()
+        # renew info on the screen
+        self.show_state()
+
+    def on_vehicle_destroy(self, payload: dict) -> None:
+        """Counts a vehicle destroyed by a tracked character, only with TRACK_ALL_WEAPONS"""
+
+        attacker_id = payload.get('attacker_character_id')
+        if not TRACK_ALL_WEAPONS or attacker_id not in self.ids_and_names:
+            return
+        # own vehicles and vehicles of own faction don't count
+        if payload.get('character_id') == attacker_id:
+            return
+        team_id = payload.get('team_id')
+        if team_id is not None and team_id == payload.get('attacker_team_id'):
+            return
+        if self.event_seen(payload):
+            return
+        self.count_weapon(attacker_id, payload.get('attacker_weapon_id'), vehicle=True)
+        if self.ids_and_names[attacker_id] == self.char_online:
+            self.show_state()
+
+    def on_login(self, name: str, census) -> None:
+        """A tracked character logged in. It goes on the screen, its stats are requested in background"""
+
+        if name != self.char_online:
+            self.values_to_default()
+            self.char_online = name
+            # known counters and the leaderboard from memory go on the screen at once
+            slot = self.shown_slot(name)
+            if slot is not None:
+                self.show_slot(slot)
+                self.show_state()
+        if name not in self.online_chars:
+            self.online_chars.append(name)
+        print(f'<on_login> {self.char_online} login')
+        # http requests go in background, the loop goes on receiving events
+        self.cancel_refresh()
+        self.refresh_task = asyncio.create_task(self.login_refresh(census))
+
+    def on_logout(self, name: str, census) -> None:
+        """A tracked character logged out. If it was on the screen, all the
+        values should become default or another online character is shown"""
+
+        print(f'<on_logout> {name} logout')
+        if name in self.online_chars:
+            self.online_chars.remove(name)
+        # somebody else is on the screen, nothing to change there
+        if name != self.char_online:
+            return
+        self.cancel_refresh()
+        self.values_to_default()
+        # another tracked character is still online, show it instead
+        if self.online_chars:
+            self.char_online = self.online_chars[-1]
+            self.refresh_task = asyncio.create_task(self.login_refresh(census))
+        self.show_state()
+
+    async def backfill(self, census, since: int) -> None:
+        """Runs after a reconnect. Counts kills of the tracked characters made while
+        the push connection was down, then catches up with missed logins and logouts"""
+
+        was_online = list(self.online_chars)
+        # online_chars and char_online stay as they are, live logins and logouts keep
+        # changing them while census answers, and the task may be cancelled meanwhile
+        online = await self.get_online_char()
+        now_online = online if online is not None else was_online
+        # a character could log out during the gap, its kills before that count too
+        chars = was_online + [ name for name in now_online if name not in was_online ]
+        wait = RECONNECT_BASE_DELAY
+        while True:
+            pages = await asyncio.gather(*[ self.get_kills_since(name, since) for name in chars ], return_exceptions=True)
+            failed = [ name for name, page in zip(chars, pages) if isinstance(page, Exception) ]
+            rows = sorted(
+                [ row for page in pages if not isinstance(page, Exception) for row in page ],
+                key=lambda row: int(row['timestamp']),
+            )
+            counted = sum(self.kill_slots)
+            for row in rows:
+                self.on_death(row)
+                self.note_event_time(row)
+            print(f'<backfill> {len(rows)} kills since {since}, {sum(self.kill_slots) - counted} of them counted')
+            if not failed:
                 break
-        if len(LEADERS) > 1:
-            GOAL_KILLS = LEADERS[0][1]
-    # there could be a few errors, in this situation it doesn't matter what happened
-    # matters that we didn't get the data. Gun name, id and stats are needed
-    except Exception as e:
-        print('Error occured:', e)        
-
-
-async def connect_census():
-    """Connects to census, subscribes to events and processes them"""
-
-    global CENSUS_LOOP_RUNNING_OK, KILLS, CHAR_ONLINE
-    # before the census connection restore all variables and fetch stats
-    global_values_to_default()
-    get_online_char()
-    if CHAR_ONLINE:
-        get_stats()
-        get_leaders()
-    if not NAMES_AND_IDS:
-        print(f'<run_stuff> character IDs or gun ID wasnt received from census, try to restart')
-        CENSUS_LOOP_RUNNING_OK = False
-        return
-    update_text(SOURCE, string_prepare())
-    try:
-        print('<connect_census> connecting to census...')
-        census = await websockets.connect( f"wss://push.planetside2.com/streaming?environment=ps2&service-id=s:{SERVICE_ID}" )
-        if census.open:
+            # the gap stays open, if the connection drops meanwhile the next backfill covers it
+            print(f'<backfill> kills of {", ".join(failed)} werent received, next try in {wait} seconds')
+            chars = failed
+            await asyncio.sleep(wait)
+            wait = min(wait * 2, RECONNECT_MAX_DELAY)
+        self.backfill_since = None
+        # only characters which no live login or logout has changed meanwhile, the live ones are newer
+        for name in was_online:
+            if name not in now_online and name in self.online_chars:
+                self.on_logout(name, census)
+        for name in now_online:
+            if name not in was_online and name not in self.online_chars:
+                self.on_login(name, census)
+
+    def classify_message(self, message: str) -> tuple:
+        """Looks at the raw message without decoding it. Returns its kind and True if it
+        has to be processed: subscription acknowledgements, kills which are in the kills
+        dispatch table, deaths of tracked characters which end their streaks, logins
+        and logouts of tracked characters and, with TRACK_ALL_WEAPONS, all kills and
+        vehicle kills of tracked characters. Heartbeats,
+        service state messages and events of untracked guns are dropped"""
+
+        if '"heartbeat"' in message:
+            return 'heartbeat', False
+        event_name = _EVENT_NAME.search(message)
+        if event_name is None:
+            if '"subscription"' in message:
+                return 'subscription', True
+            return 'other', False
+        kind = event_name.group(1)
+        if kind == 'Death':
+            attacker = _ATTACKER_ID.search(message)
+            weapon = _WEAPON_ID.search(message)
+            if attacker and weapon and (attacker.group(1), weapon.group(1)) in self.kill_index:
+                return kind, True
+            if TRACK_ALL_WEAPONS and attacker and attacker.group(1) in self.ids_and_names:
+                return kind, True
+            victim = _CHARACTER_ID.search(message)
+            return kind, bool(victim) and victim.group(1) in self.ids_and_names
+        if kind == 'VehicleDestroy':
+            attacker = _ATTACKER_ID.search(message)
+            return kind, TRACK_ALL_WEAPONS and bool(attacker) and attacker.group(1) in self.ids_and_names
+        if kind == 'PlayerLogin' or kind == 'PlayerLogout':
+            character = _CHARACTER_ID.search(message)
+            return kind, bool(character) and character.group(1) in self.ids_and_names
+        return kind, False
+
+    # FOR THE CENSUS CONNECTION
+
+    async def watchdog(self, census) -> None:
+        """Closes the connection if the push service is silent for longer than
+        STREAM_SILENCE_LIMIT. It sends heartbeats every 30 seconds, so silence
+        means a half-open connection which would never deliver anything"""
+
+        while True:
+            await asyncio.sleep(STREAM_SILENCE_LIMIT / 5)
+            silence = time.monotonic() - self.last_message_at
+            if silence > STREAM_SILENCE_LIMIT:
+                print(f'<watchdog> no messages for {silence:.0f} seconds, reconnecting')
+                await census.close()
+                return
+
+    async def connect_census(self) -> bool:
+        """Connects to census, subscribes to events and processes them. The first
+        connection fetches all the stats, after a reconnect only missed kills are requested.
+        Returns True if the connection lived long enough to be called healthy"""
+
+        global _RECEIVED_AT
+        reconnect = self.last_event_time is not None
+        if not reconnect:
+            # before the census connection restore all values and fetch stats
+            self.cancel_refresh()
+            if self.startup_task is not None:
+                self.startup_task.cancel()
+            self.values_to_default()
+            self.reset_kill_index()
+            if self.load_cached():
+                # cached numbers go on the screen at once, census data comes in background
+                self.show_state()
+                self.startup_task = asyncio.create_task(self.refresh_all())
+            else:
+                await self.refresh_all()
+        if not self.names_and_ids:
+            print(f'<run_stuff> character IDs or gun ID wasnt received from census, try to restart')
+            self.running = False
+            return False
+        census = None
+        connected_at = None
+        watchdog_task = None
+        try:
+            print('<connect_census> connecting to census...')
+            census = await websockets.connect(self.push_url or PUSH_URL, close_timeout=5)
+            connected_at = self.last_message_at = time.monotonic()
+            watchdog_task = asyncio.create_task(self.watchdog(census))
             print('SUBSCRIBING')
             # sends subscription string
             await census.send(json.dumps({
             	'service': 'event',
             	'action': 'subscribe',
-            	'characters': list(NAMES_AND_IDS.values()),
+            	'characters': list(self.names_and_ids.values()),
             	'eventNames':['Death', 'PlayerLogin', 'PlayerLogout', 'VehicleDestroy']
             }))
-            # endless loop while connected to census
-            while census.open:
-                # waiting for a message
-                message = await census.recv()
+            # new events are coming from now on, the gap before is filled in background
+            if reconnect:
+                # if the previous backfill didn't finish, its gap is still open
+                if self.backfill_since is None:
+                    self.backfill_since = self.last_event_time
+                self.backfill_task = asyncio.create_task(self.backfill(census, self.backfill_since))
+            else:
+                self.last_event_time = int(time.time())
+            # endless loop while connected to census, waiting for a message
+            async for message in census:
+                received_at = time.perf_counter()
+                received_wall = time.time()
+                record('ws', message)
+                # any message, a heartbeat too, shows the service is alive
+                self.last_message_at = time.monotonic()
                 # print('hi from thread: ', threading.get_ident())
+                kind, wanted = self.classify_message(message)
+                MESSAGE_STATS.setdefault(kind, [0, 0])[0 if wanted else 1] += 1
+                if not wanted:
+                    continue
                 # make a dict out of string
-                match json.loads(message):
+                data = json.loads(message)
+                decoded_at = time.perf_counter()
+                record_latency('decode', decoded_at - received_at)
+                # texts queued while this message is processed are measured from its receive time
+                _RECEIVED_AT = received_at
+                match data:
                     # if it's a subscription acknowledgement, no need to process it, but show the message in the log
                     case {'subscription': subs}:
                         print(f'<connect_census> successfully subscribed for {subs["characterCount"]} characters')
                     # actuall event information
                     case {'payload': payload}:
+                        # census timestamps have a precision of a second, clocks may differ a bit too
+                        if payload.get('timestamp'):
+                            record_latency('census->receive', max(0.0, received_wall - int(payload['timestamp'])))
+                        # vehicle kills carry an attacker too, they go to their own handler
+                        if payload.get('event_name') == 'VehicleDestroy':
+                            self.on_vehicle_destroy(payload)
                         # death event. We need only attacker and with the exact gun
-                        if 'attacker_character_id' in payload:
-                            if payload.get('attacker_character_id') == NAMES_AND_IDS.get(CHAR_ONLINE) and \
-                                payload.get('attacker_weapon_id') == CURRENT_GUN_ID and \
-                                payload.get('attacker_team_id') != payload.get('team_id'):
-                                KILLS += 1
-                                print(f'<connect_census> +1 kill = {KILLS}')
-                                if CLOSEST_KILLS is not None and  KILLS > CLOSEST_KILLS and len(LEADERS) > 1:
-                                    del LEADERS[-2]
-                                    if len(LEADERS) > 1:
-                                        CLOSEST_KILLS = LEADERS[-2][1]
-                                # renew info on the screen
-                                update_text(SOURCE, string_prepare())
+                        elif 'attacker_character_id' in payload:
+                            self.on_death(payload)
                         elif ('event_name') in payload:
-                            # logged out event, all the global values should become default
-                            if payload['event_name'] == 'PlayerLogout':
-                                print(f'<connect_census> {CHAR_ONLINE} logout')
-                                global_values_to_default()
-                                update_text(SOURCE, string_prepare())
+                            name = self.ids_and_names.get(payload.get('character_id'))
+                            # logged out event, all the values should become default
+                            if payload['event_name'] == 'PlayerLogout' and name:
+                                self.on_logout(name, census)
                             # log in event. Stats of the new online character should be fetched
-                            elif payload['event_name'] == 'PlayerLogin':
-                                for k, v in NAMES_AND_IDS.items():
-                                    if v == payload['character_id']:
-                                        CHAR_ONLINE = k
-                                print(f'<connect_census> {CHAR_ONLINE} login')
-                                get_stats()
-                                get_leaders()
-                                update_text(SOURCE, string_prepare())
-                                if not CURRENT_GUN_ID:
-                                    CENSUS_LOOP_RUNNING_OK = False
-                                    print('<connect_census> couldnt retrieve the current gun ID, please restart')
-                                    await census.close()
-        print('<connect_census> connection to census lost!')
-    except Exception as e:
-        print('<connect_census> connect_census connection error: ', e)
-
-
-async def census_loop():
-    """Function to reconnest to census. It waits longer between new reconnect attempts,
-    untill reaches 5000 seconds. CENSUS_LOOP_RUNNING_OK is the flag for reconnecting or not"""
-    sleep_time = 10
-    while True:
-        # check if we should reconnect at all
-        if not CENSUS_LOOP_RUNNING_OK:
-            break
-        await connect_census()
-        # if we are here, then census connection is closed/dropped
-        print(f'failed to connect to census, waiting for {sleep_time} seconds')
-        await asyncio.sleep(sleep_time)
-        # waiting before the reconnec attempt
-        if sleep_time < 5000:
-            sleep_time = sleep_time * 2
-
-def global_values_to_default() -> None:
-    """When a character logged off or census connection was lot,
-    all changed global values should get the default state and
-    the algoritm begins to work from the scratch"""
-
-    global KILLS, CURRENT_GUN, CHAR_ONLINE, CURRENT_GUN_ID, CHAR_ONLINE, LEADERS, CLOSEST_KILLS, GOAL_KILLS
-    LEADERS = []
-    KILLS = CURRENT_GUN = 'n/a' # n/a because this will be shown on the screen
-    CURRENT_GUN_ID = CHAR_ONLINE = CLOSEST_KILLS = GOAL_KILLS = None
+                            elif payload['event_name'] == 'PlayerLogin' and name:
+                                self.on_login(name, census)
+                        self.note_event_time(payload)
+                _RECEIVED_AT = None
+                record_latency('dispatch', time.perf_counter() - decoded_at)
+            print('<connect_census> connection to census lost!')
+        except Exception as e:
+            print('<connect_census> connect_census connection error: ', e)
+        # a stop cancels the task, the connection and its tasks are closed then too
+        finally:
+            print(f'<connect_census> messages processed/dropped: {message_stats()}')
+            children = [ task for task in (watchdog_task, self.backfill_task) if task is not None ]
+            self.backfill_task = None
+            for task in children:
+                task.cancel()
+            if children:
+                await asyncio.wait(children)
+            if census is not None:
+                await census.close()
+            self.cache_kills()
+        return connected_at is not None and time.monotonic() - connected_at >= HEALTHY_SESSION
+
+    async def census_loop(self):
+        """Function to reconnest to census. Waits between reconnect attempts grow twice
+        each time up to RECONNECT_MAX_DELAY and are randomized, so many scripts don't
+        reconnect at the same moment. A healthy connection makes the next wait short again.
+        running is the flag for reconnecting or not"""
+        attempt = 0
+        while True:
+            # check if we should reconnect at all
+            if not self.running:
+                break
+            if await self.connect_census():
+                attempt = 0
+            # if we are here, then census connection is closed/dropped
+            sleep_time = random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** min(attempt, 16)))
+            print(f'census connection is closed, waiting for {sleep_time:.1f} seconds')
+            # waiting before the reconnec attempt
+            await asyncio.sleep(sleep_time)
+            attempt += 1
+
+    def start_tasks(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Starts the census connection and the background work of the tracker on the loop"""
+
+        # every start counts from census stats, not from kills of the previous run
+        self.last_event_time = self.backfill_since = None
+        # the screen could be changed since the last run, every text goes there again
+        for widget in self.widgets:
+            widget.text = None
+        self.census_task = loop.create_task(self.census_loop())
+        self.prefetch_task = loop.create_task(self.prefetch_leaderboards())
+        self.metrics_task = loop.create_task(self.metrics_tick())
+        self.reconcile_task = loop.create_task(self.reconcile_loop())
+
+    async def stop(self) -> None:
+        """Cancels all tasks of the tracker and waits until they are over. The push
+        connection is closed by connect_census on the way"""
+
+        self.running = False
+        tasks = [
+            task for task in (
+                self.census_task, self.prefetch_task, self.metrics_task, self.reconcile_task,
+                self.refresh_task, self.startup_task, self.backfill_task,
+            ) if task is not None
+        ]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+        self.census_task = self.prefetch_task = self.metrics_task = self.reconcile_task = None
+        self.refresh_task = self.startup_task = self.backfill_task = None
+
+
+# the tracker of the OBS script and of run_headless
+TRACKER = Tracker()
 
 
 # FOR HOTKEYS AND BUTTONS
@@ -348,11 +2051,11 @@ h3 = h() # Hotkey to show and hide the leaderboard
 def start() -> str:
     """Used to start the execution. Called from a hotkey or a button"""
 
-    global _THREAD, CENSUS_LOOP_RUNNING_OK
-    if not CENSUS_LOOP_RUNNING_OK:
+    global _THREAD
+    if not TRACKER.running:
         # execution start with a background thread
         if not _THREAD and not _LOOP:
-            CENSUS_LOOP_RUNNING_OK = True
+            TRACKER.running = True
             _THREAD = threading.Thread(None, run_stuff, daemon=True)
             _THREAD.start()
         return '<start> kills counter begun its work'
@@ -373,7 +2076,8 @@ def stop_execution(pressed):
     if pressed:
         if _THREAD or _LOOP:
             script_unload()
-            update_text(SOURCE, string_prepare())
+            # the census thread may still be stopping, the screen gets empty values at once
+            update_outputs(string_prepare(TrackerState()))
             return print('Kills counter stops')
         else:
             return print('Kills counter isnt working')
@@ -383,68 +2087,392 @@ def show_leaderboard_hotkey(pressed):
     and hide on key release"""
 
     if pressed:
+        # runs on the OBS thread, all values are taken from one snapshot
+        state = TRACKER.state
         # show the whole leaderboard. Grows down
-        if len(LEADERS) > 1:
-            update_text(SOURCE, 'LEADRERBOARD\n' + '\n'.join([ f'{leader[0]} - {leader[1]} kills' for leader in LEADERS ]))
-        elif len(LEADERS) == 1:
-            update_text(SOURCE, f'The leader is {CHAR_ONLINE}')
+        if state.leaders:
+            update_outputs('LEADRERBOARD\n' + leaderboard_text(state))
         else:
-            update_text(SOURCE, f'The leaderboard was not loaded')
+            update_outputs(leaderboard_text(state))
         return print('Showing leaders')
     else:
         # show the normal string
-        update_text(SOURCE, string_prepare())
+        update_outputs(string_prepare())
         return print('Not showing leaders')
 
 # FOR ONSCREEN TEXT
 
-def string_prepare():
-    """contains a template of a commonly used string"""
+def string_prepare(state: TrackerState | None = None):
+    """fills the counter template, the commonly used string. Takes the state of TRACKER if no state is given"""
 
-    return f'{CURRENT_GUN} kills: {KILLS}{"/" + str(GOAL_KILLS) if GOAL_KILLS else ""}'
+    return TRACKER.widgets[0].format(state or TRACKER.state)
 
 def update_text(text_source: str, scripted_text: str):
-    """takes scripted_text , sets its value in obs on the screen"""
+    """takes scripted_text and queues it for the text source. Can be called from
+    any thread, the text gets on the screen with the next render_tick. If a few
+    updates come between two ticks, only the last one is shown"""
+
+    with _RENDER_LOCK:
+        _RENDER_QUEUE[text_source] = scripted_text
+        # the oldest event waiting for this source is the one to measure
+        if _RECEIVED_AT is not None:
+            _RENDER_SINCE.setdefault(text_source, _RECEIVED_AT)
+
+
+def update_outputs(scripted_text: str):
+    """queues the text for SOURCE and all EXTRA_SOURCES"""
+
+    update_text(SOURCE, scripted_text)
+    for text_source in EXTRA_SOURCES:
+        update_text(text_source, scripted_text)
+
+
+def render_tick():
+    """OBS timer callback, runs on the OBS main thread, or on _LOOP without OBS.
+    Gives queued texts to all SINKS, skips the ones which are already there"""
+
+    global _RENDER_QUEUE, _RENDER_SINCE
+    if not _RENDER_QUEUE:
+        return
+    with _RENDER_LOCK:
+        pending, _RENDER_QUEUE = _RENDER_QUEUE, {}
+        since, _RENDER_SINCE = _RENDER_SINCE, {}
+    for text_source, scripted_text in pending.items():
+        if not text_source or _RENDERED.get(text_source) == scripted_text:
+            continue
+        for sink in SINKS:
+            # one broken sink shouldn't stop the others
+            try:
+                sink.write(text_source, scripted_text)
+            except Exception as e:
+                print(f'<render_tick> {type(sink).__name__} failed:', e)
+        _RENDERED[text_source] = scripted_text
+        if text_source in since:
+            record_latency('receive->screen', time.perf_counter() - since[text_source])
+
+
+async def render_loop() -> None:
+    """Does what the OBS timer does when there's no OBS"""
+
+    while True:
+        render_tick()
+        await asyncio.sleep(1 / RENDER_FPS)
 
-    with source_ar(text_source) as source, data_ar() as settings:
-        obs.obs_data_set_string(settings, "text", scripted_text)
-        obs.obs_source_update(source, settings)
+
+def set_render_rate(fps: int) -> None:
+    """(Re)starts the render_tick timer with the given maximum of updates per second"""
+
+    global RENDER_FPS
+    RENDER_FPS = max(1, fps)
+    obs.timer_remove(render_tick)
+    obs.timer_add(render_tick, 1000 // RENDER_FPS)
 
 
 def text_source_searcher() -> list:
-    """Searches only text sources among all sources, returns
-    a list of their names"""
+    """Returns names of all text sources. Sources are enumerated only the first
+    time, after that the registry is kept by OBS signals"""
+
+    if not _TEXT_SOURCES_READY:
+        text_sources_rebuild()
+    return sorted(_TEXT_SOURCES)
+
+
+def text_sources_rebuild() -> None:
+    """Walks all sources once and remembers the text ones"""
 
+    global _TEXT_SOURCES_READY
     sources = obs.obs_enum_sources()
-    result = []
+    _TEXT_SOURCES.clear()
     for source in sources:
-        source_id = obs.obs_source_get_unversioned_id(source)
-        if source_id == "text_gdiplus" or source_id == "text_ft2_source":
-            result.append(obs.obs_source_get_name(source))
+        if obs.obs_source_get_unversioned_id(source) in TEXT_SOURCE_IDS:
+            _TEXT_SOURCES.add(obs.obs_source_get_name(source))
     obs.source_list_release(sources)    
-    return result
+    _TEXT_SOURCES_READY = True
+
+
+def is_text_source(text_source: str | None) -> bool:
+    """O(1) check that the text source exists"""
+
+    if not _TEXT_SOURCES_READY:
+        text_sources_rebuild()
+    return text_source in _TEXT_SOURCES
+
+
+def connect_source_signals() -> None:
+    """Keeps the registry of text sources with OBS signals. OBS disconnects them itself on unload"""
+
+    handler = obs.obs_get_signal_handler()
+    obs.signal_handler_connect(handler, "source_create", on_source_create)
+    obs.signal_handler_connect(handler, "source_destroy", on_source_destroy)
+    obs.signal_handler_connect(handler, "source_rename", on_source_rename)
+
+
+def on_source_create(calldata):
+    source = obs.calldata_source(calldata, "source")
+    if obs.obs_source_get_unversioned_id(source) in TEXT_SOURCE_IDS:
+        _TEXT_SOURCES.add(obs.obs_source_get_name(source))
+
+
+def rename_widget_sources(prev_name: str, new_name: str | None) -> None:
+    """The goal and the leaderboard widgets follow renames of their sources too.
+    None as the new name removes the source. The tuple is swapped, the census thread
+    sees either the old or the new one"""
+
+    for widget in TRACKER.widgets:
+        if widget.sources is None or prev_name not in widget.sources:
+            continue
+        if new_name is None:
+            widget.sources = tuple([ text_source for text_source in widget.sources if text_source != prev_name ])
+        else:
+            widget.sources = tuple([ new_name if text_source == prev_name else text_source for text_source in widget.sources ])
+
+
+def on_source_destroy(calldata):
+    global SOURCE, EXTRA_SOURCES
+    name = obs.obs_source_get_name(obs.calldata_source(calldata, "source"))
+    _TEXT_SOURCES.discard(name)
+    # OBS crashes if text goes into a source which doesn't exist
+    if name == SOURCE:
+        SOURCE = None
+    if name in EXTRA_SOURCES:
+        EXTRA_SOURCES = tuple([ text_source for text_source in EXTRA_SOURCES if text_source != name ])
+    rename_widget_sources(name, None)
+
+
+def on_source_rename(calldata):
+    global SOURCE, EXTRA_SOURCES
+    new_name = obs.calldata_string(calldata, "new_name")
+    prev_name = obs.calldata_string(calldata, "prev_name")
+    if prev_name not in _TEXT_SOURCES:
+        return
+    _TEXT_SOURCES.discard(prev_name)
+    _TEXT_SOURCES.add(new_name)
+    # the picked sources follow their new names
+    if SOURCE == prev_name:
+        SOURCE = new_name
+    EXTRA_SOURCES = tuple([ new_name if text_source == prev_name else text_source for text_source in EXTRA_SOURCES ])
+    rename_widget_sources(prev_name, new_name)
+    rename_in_settings(prev_name, new_name)
+
+
+def rename_in_settings(prev_name: str, new_name: str) -> None:
+    """Saved settings follow renames too, otherwise the next script_update
+    or OBS launch wouldn't find the old name and would drop the source"""
+
+    settings = _SETTINGS
+    if settings is None:
+        return
+    for name in ("source", "goal_source", "leaderboard_source"):
+        if obs.obs_data_get_string(settings, name) == prev_name:
+            obs.obs_data_set_string(settings, name, new_name)
+    # items of the array are shared with the settings, changing them changes the settings
+    array = obs.obs_data_get_array(settings, "extra_sources")
+    for index in range(obs.obs_data_array_count(array)):
+        item = obs.obs_data_array_item(array, index)
+        if obs.obs_data_get_string(item, "value") == prev_name:
+            obs.obs_data_set_string(item, "value", new_name)
+        obs.obs_data_release(item)
+    obs.obs_data_array_release(array)
+
+
+# FOR OUTPUT SINKS
+
+class Sink(ABC):
+    """Where rendered texts go. write is called from render_tick, start and close on _LOOP.
+    Every sink has its own write, start and close do nothing unless a sink needs them"""
+
+    @abstractmethod
+    def write(self, text_source: str, scripted_text: str) -> None:
+        """Shows the text of the source, must not block the OBS thread"""
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class ObsSink(Sink):
+    """Puts texts into OBS text sources, only on the OBS main thread"""
+
+    def write(self, text_source: str, scripted_text: str) -> None:
+        # the source could be deleted after the text was queued
+        if _TEXT_SOURCES_READY and text_source not in _TEXT_SOURCES:
+            return
+        with source_ar(text_source) as source, data_ar() as settings:
+            obs.obs_data_set_string(settings, "text", scripted_text)
+            obs.obs_source_update(source, settings)
+
+
+class FileSink(Sink):
+    """Writes texts into a file which is replaced at once, a reader never sees
+    a half written text. {source} in the path is replaced with the source name"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, text_source: str, scripted_text: str) -> None:
+        path = self.path.replace('{source}', re.sub(r'[^\w.-]', '_', text_source))
+        temp = path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as file:
+            file.write(scripted_text)
+        os.replace(temp, path)
+
+
+class StdoutSink(Sink):
+    """Prints texts to the console"""
+
+    def write(self, text_source: str, scripted_text: str) -> None:
+        print(f'[{text_source}]\n{scripted_text}', flush=True)
+
+
+class HttpSink(Sink):
+    """Serves texts on a local port. /<source> is a page for a browser source which
+    gets every new text through a websocket, /text/<source> is the plain text"""
+
+    PAGE = """<!doctype html>
+<meta charset="utf-8">
+<style>body { margin: 0; color: white; font: bold 36px sans-serif; white-space: pre; }</style>
+<body><script>
+function connect() {
+    const ws = new WebSocket(`ws://${location.host}/ws${location.pathname}`);
+    ws.onmessage = (event) => { document.body.textContent = event.data; };
+    ws.onclose = () => setTimeout(connect, 1000);
+}
+connect();
+</script></body>
+"""
+
+    def __init__(self, port: int, host: str = '127.0.0.1'):
+        self.host = host
+        self.port = port
+        self.texts = {} # source name -> the latest text
+        self.clients = {} # source name -> set of connected websockets
+        self.loop = None
+        self.runner = None
+
+    async def start(self) -> None:
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get('/text/{source}', self.text)
+        app.router.add_get('/ws/{source}', self.websocket)
+        app.router.add_get('/{source}', self.page)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.loop = asyncio.get_running_loop()
+        print(f'<HttpSink> texts are on http://{self.host}:{self.port}/<source>')
+
+    async def close(self) -> None:
+        self.loop = None
+        for clients in self.clients.values():
+            for ws in list(clients):
+                await ws.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def write(self, text_source: str, scripted_text: str) -> None:
+        # in OBS render_tick runs on the OBS thread, websockets live on _LOOP
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.send, text_source, scripted_text)
+
+    def send(self, text_source: str, scripted_text: str) -> None:
+        self.texts[text_source] = scripted_text
+        for ws in self.clients.get(text_source, ()):
+            self.loop.create_task(ws.send_str(scripted_text))
+
+    async def page(self, request):
+        from aiohttp import web
+        return web.Response(text=self.PAGE, content_type='text/html')
+
+    async def text(self, request):
+        from aiohttp import web
+        return web.Response(text=self.texts.get(request.match_info['source'], ''))
+
+    async def websocket(self, request):
+        from aiohttp import web
+        text_source = request.match_info['source']
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        self.clients.setdefault(text_source, set()).add(ws)
+        try:
+            if text_source in self.texts:
+                await ws.send_str(self.texts[text_source])
+            # the page sends nothing, waiting until it goes away
+            async for _ in ws:
+                pass
+        finally:
+            self.clients[text_source].discard(ws)
+        return ws
+
+
+async def start_sinks() -> None:
+    for sink in SINKS:
+        try:
+            await sink.start()
+        except Exception as e:
+            print(f'<start_sinks> {type(sink).__name__} didnt start:', e)
+
+
+async def close_sinks() -> None:
+    for sink in SINKS:
+        try:
+            await sink.close()
+        except Exception as e:
+            print(f'<close_sinks> {type(sink).__name__} didnt close:', e)
 
 
 # FOR LOOP AND THREAD EXECUTION
 
 def run_stuff():
     """The main function. Runs the program logic"""
-    global _LOOP
+    global _LOOP, _RENDER_TASK
     if not SOURCE:
         print('<run_stuff> you forgot to assign the source!')
         return
-    if not CENSUS_LOOP_RUNNING_OK:
+    if not TRACKER.running:
         print(f'<run_stuff> LOOP is not allowed to run')
         return
+    # buckets and requests belong to the loop of the previous run
+    _BUCKETS.clear()
+    _IN_FLIGHT.clear()
+    # the screen could be changed since the last run, every text goes there again
+    _RENDERED.clear()
     _LOOP = asyncio.new_event_loop()
     asyncio.set_event_loop(_LOOP)
+    cache_open()
+    recorder_open()
+    _LOOP.run_until_complete(start_sinks())
     print('<run_stuff> creating tasks')
-    _LOOP.create_task(census_loop())
+    if obs is None:
+        _RENDER_TASK = _LOOP.create_task(render_loop())
+    TRACKER.start_tasks(_LOOP)
     print('<run_stuff> running')
     _LOOP.run_forever()
     # Stop anything that is running on the loop before closing. Most likely
     # using the loop run_until_complete function
+    _LOOP.run_until_complete(TRACKER.stop())
+    # whatever is left, REST requests nobody waits for among them
+    tasks = asyncio.all_tasks(_LOOP)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        _LOOP.run_until_complete(asyncio.wait(tasks))
+    if _RENDER_TASK is not None:
+        _RENDER_TASK = None
+        # the last texts, the empty ones after stop among them
+        render_tick()
+    _LOOP.run_until_complete(close_sinks())
+    _LOOP.run_until_complete(close_sessions())
+    print(f'<run_stuff> {rest_summary()}')
+    print(f'<run_stuff> {reconcile_summary()}')
+    print(f'<run_stuff> leaderboards from memory: {LEADERBOARD_STATS["memory"]}, '
+          f'pages not modified: {LEADERBOARD_STATS["not_modified"]}, downloaded: {LEADERBOARD_STATS["downloaded"]}')
     _LOOP.close()
+    TRACKER.cache_kills()
+    cache_close()
+    recorder_close()
     _LOOP = None
 
 
@@ -456,17 +2484,58 @@ def script_description():
     return "<h2>PS2 special guns kills counter</h2> \n <p>The lord should be defeated</p> "
 
 
+def script_defaults(settings):
+    """Default values of hand-made settings"""
+
+    obs.obs_data_set_default_int(settings, "render_fps", RENDER_FPS)
+    obs.obs_data_set_default_string(settings, "template", TEXT_TEMPLATE)
+    obs.obs_data_set_default_string(settings, "goal_template", GOAL_TEMPLATE)
+    obs.obs_data_set_default_string(settings, "leaderboard_template", LEADERBOARD_TEMPLATE)
+
+
 def script_update(settings):
     """Called every time when a user changes anything in hand-made settings"""
 
-    global SOURCE
+    global SOURCE, EXTRA_SOURCES
+    # text updates go to the screen not more often than this
+    set_render_rate(obs.obs_data_get_int(settings, "render_fps"))
     # user can make a pick only among existing sources
     SOURCE = obs.obs_data_get_string(settings, "source")
     # but in a case we took the preserved source from the previous launch
     # and the source was deleted afterwards, we should check it out
-    sources = text_source_searcher()
-    if not SOURCE in sources:
+    if not is_text_source(SOURCE):
         SOURCE = None
+    # the same check for the extra sources, the list is replaced as a whole
+    extra = []
+    array = obs.obs_data_get_array(settings, "extra_sources")
+    for index in range(obs.obs_data_array_count(array)):
+        item = obs.obs_data_array_item(array, index)
+        name = obs.obs_data_get_string(item, "value")
+        obs.obs_data_release(item)
+        if is_text_source(name) and name != SOURCE and name not in extra:
+            extra.append(name)
+    obs.obs_data_array_release(array)
+    EXTRA_SOURCES = tuple(extra)
+    update_widgets(settings)
+
+
+def update_widgets(settings):
+    """Parses templates of the counter, the goal and the leaderboard sources once,
+    rendering only fills them in. The sources without a picked text source are skipped"""
+
+    widgets = [make_widget(None, obs.obs_data_get_string(settings, "template"), TEXT_TEMPLATE)]
+    for name, default in (("goal", GOAL_TEMPLATE), ("leaderboard", LEADERBOARD_TEMPLATE)):
+        text_source = obs.obs_data_get_string(settings, name + "_source")
+        if is_text_source(text_source):
+            widgets.append(make_widget((text_source,), obs.obs_data_get_string(settings, name + "_template"), default))
+    TRACKER.set_widgets(tuple(widgets))
+    # the new texts go to the screen at once
+    loop = _LOOP
+    if loop is not None:
+        try:
+            loop.call_soon_threadsafe(TRACKER.show_state)
+        except RuntimeError:
+            pass
 
 
 def script_properties():
@@ -483,8 +2552,31 @@ def script_properties():
     )
     obs.obs_property_set_long_description(p, "Add a text source in sources, put it's name here")
     # put all text sources in the drop box
-    for name in text_source_searcher():
+    text_sources = text_source_searcher()
+    for name in text_sources:
         obs.obs_property_list_add_string(p, name, name)
+    p = obs.obs_properties_add_text(props, "template", "Counter template", obs.OBS_TEXT_MULTILINE)
+    obs.obs_property_set_long_description(p, "Placeholders like {gun}, {kills}, {goal}, see TEXT_TEMPLATE in the script")
+
+    # the goal and the leaderboard may have their own sources, nothing goes there if none is picked
+    for name, title in (("goal", "Goal and rank"), ("leaderboard", "Leaderboard")):
+        p = obs.obs_properties_add_list(
+            props, name + "_source", f"{title} source", obs.OBS_COMBO_TYPE_LIST, obs.OBS_COMBO_FORMAT_STRING,
+        )
+        obs.obs_property_list_add_string(p, "", "")
+        for text_source in text_sources:
+            obs.obs_property_list_add_string(p, text_source, text_source)
+        obs.obs_properties_add_text(props, name + "_template", f"{title} template", obs.OBS_TEXT_MULTILINE)
+
+    # the same text may go to a few more sources, in other scenes for example
+    p = obs.obs_properties_add_editable_list(
+        props, "extra_sources", "Also show in", obs.OBS_EDITABLE_LIST_TYPE_STRINGS, None, None,
+    )
+    obs.obs_property_set_long_description(p, "Names of more text sources for the same text")
+
+    # how often the text on the screen may change
+    p = obs.obs_properties_add_int_slider(props, "render_fps", "Max text updates per second", 1, 60, 1)
+    obs.obs_property_set_long_description(p, "A few kills in a row are shown with one update")
 
     obs.obs_properties_add_button(
         props, "button1", "Start", lambda *props: start()
@@ -494,9 +2586,23 @@ def script_properties():
         props, "button2", "Stop", lambda *props: script_unload()
     )
 
+    # p50/p95/p99 of every stage from the game event to the screen and of REST requests
+    obs.obs_properties_add_text(props, "latency", latency_summary(), obs.OBS_TEXT_INFO)
+    obs.obs_properties_add_button(props, "button3", "Refresh latency", show_latency)
+
     return props
 
 
+def show_latency(props, prop):
+    """Button callback, renews the latency summary in the settings and prints it"""
+
+    summary = f'{latency_summary()}\n{rest_summary()}\n{reconcile_summary()}'
+    print(f'<show_latency>\n{summary}')
+    obs.obs_property_set_description(obs.obs_properties_get(props, "latency"), summary)
+    # True makes OBS redraw the settings
+    return True
+
+
 def script_save(settings):
     """Called when closing OBS"""
     # saving our binded hotkeys
@@ -507,6 +2613,12 @@ def script_save(settings):
 
 def script_load(settings):
     """Called on OBS launch"""
+    global _SETTINGS
+    _SETTINGS = settings
+    SINKS[:] = [ObsSink()]
+    if HTTP_SINK_PORT:
+        SINKS.append(HttpSink(HTTP_SINK_PORT))
+    connect_source_signals()
     # addition of hotkeys to settings menu
     h1.htk_copy = Hotkey(start_hotkey, settings, "Start kills counter")
     h2.htk_copy = Hotkey(stop_execution, settings, "Stop kills counter")
@@ -516,11 +2628,19 @@ def script_load(settings):
 def script_unload():
     """Called on reload. Tries to stop the loop and the deamonized thread."""
 
-    global _THREAD, _LOOP, CENSUS_LOOP_RUNNING_OK
-    CENSUS_LOOP_RUNNING_OK = False
-    global_values_to_default()
-    if _LOOP is not None:
-        _LOOP.call_soon_threadsafe(lambda l: l.stop(), _LOOP)
+    global _THREAD, _LOOP
+    TRACKER.running = False
+    print(f'<script_unload> latency\n{latency_summary()}')
+    loop = _LOOP
+    try:
+        if loop is None:
+            raise RuntimeError('no loop')
+        # values belong to the census thread, it resets them itself before stopping
+        loop.call_soon_threadsafe(TRACKER.values_to_default)
+        loop.call_soon_threadsafe(lambda l: l.stop(), loop)
+    except RuntimeError:
+        # the census thread is not running or has closed its loop already
+        TRACKER.values_to_default()
 
     if _THREAD is not None:
         # Wait for 5 seconds, if it doesn't exit just move on not to block
@@ -529,3 +2649,44 @@ def script_unload():
         _THREAD.join(timeout=2)
         print('<script_unload> stopped the execution')
         _THREAD = None
+
+
+# WITHOUT OBS
+
+def run_headless():
+    """Runs the same census pipeline without OBS, texts go to the sinks from the command line.
+    Stops on Ctrl+C"""
+
+    import argparse
+    global SOURCE, RENDER_FPS
+    parser = argparse.ArgumentParser(description='PS2 special guns kills counter without OBS')
+    parser.add_argument('--source', default='kills', help='name of the text, used by --file and --http')
+    parser.add_argument('--file', metavar='PATH', action='append', default=[], help='write the text into a file, {source} is replaced')
+    parser.add_argument('--http', metavar='PORT', type=int, help='serve the text for browser sources on a local port')
+    parser.add_argument('--stdout', action='store_true', help='print the text')
+    parser.add_argument('--fps', type=int, default=RENDER_FPS, help='the maximum of text updates per second')
+    parser.add_argument('--nice', type=int, default=0, help='lower the process priority, where supported')
+    args = parser.parse_args()
+
+    SINKS[:] = [ FileSink(path) for path in args.file ]
+    if args.http:
+        SINKS.append(HttpSink(args.http))
+    if args.stdout or not SINKS:
+        SINKS.append(StdoutSink())
+    if args.nice and hasattr(os, 'nice'):
+        os.nice(args.nice)
+    SOURCE = args.source
+    RENDER_FPS = max(1, args.fps)
+    print(start())
+    thread = _THREAD
+    try:
+        while thread.is_alive():
+            thread.join(0.5)
+    except KeyboardInterrupt:
+        script_unload()
+        # the census thread closes sessions and sinks, there's no OBS to hurry up for
+        thread.join(timeout=10)
+
+
+if __name__ == '__main__':
+    run_headless()